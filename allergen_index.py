@@ -0,0 +1,120 @@
+import os
+import re
+
+import pandas as pd
+
+from food_catalog import canonical_name
+
+INGREDIENTS_PATH = "food_ingredients.csv"
+
+# Allergen -> ingredient / dish terms that contain it.
+# A user term matching any entry of a group excludes the whole group.
+ALLERGEN_SYNONYMS = {
+    "egg": ["egg", "omelette", "boiled egg", "anda", "mayonnaise"],
+    "wheat": ["wheat", "whole wheat flour", "wheat flour", "atta", "maida", "semolina",
+              "bread", "roti", "paratha", "naan", "gluten", "barley"],
+    "nuts": ["nuts", "nut", "almonds", "cashew nuts", "walnuts", "pistachio", "mix nuts"],
+    "peanut": ["peanut", "peanuts"],
+    "seafood": ["seafood", "fish", "prawn", "shrimp", "crab"],
+    "mushroom": ["mushroom"],
+    "dairy": ["dairy", "milk", "yogurt", "cream", "ice cream", "butter", "ghee", "paneer",
+              "cheese", "lassi"],
+    "soy": ["soy", "soy sauce", "soybean"],
+}
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_term(term):
+    """'Allergy: Eggs' -> 'egg'"""
+    term = str(term).lower().strip()
+    term = re.sub(r"^allergy\s*:\s*", "", term)
+    term = _NON_ALNUM.sub(" ", term).strip()
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        term = term[:-1]
+    return term
+
+
+_TERM_GROUPS = {}
+for _group, _terms in ALLERGEN_SYNONYMS.items():
+    for _t in [_group] + _terms:
+        _TERM_GROUPS.setdefault(normalize_term(_t), set()).add(_group)
+
+
+def expand(term):
+    """A user allergy term plus every synonym of the allergen groups it names."""
+    term = normalize_term(term)
+    terms = {term}
+    for group in _TERM_GROUPS.get(term, ()):
+        terms.update(normalize_term(t) for t in [group] + ALLERGEN_SYNONYMS[group])
+    return terms
+
+
+def user_allergies(profile):
+    """Allergies from the profile, including 'Allergy: X' health conditions."""
+    allergies = list(profile.get("allergies") or [])
+    for condition in profile.get("health_conditions") or []:
+        if str(condition).lower().startswith("allergy"):
+            allergies.append(condition)
+    return [a for a in allergies if normalize_term(a)]
+
+
+def load_ingredients(path=INGREDIENTS_PATH):
+    """canonical food name -> list of ingredients"""
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path)
+    return {
+        canonical_name(name): [i.strip() for i in str(ingredients).split(";") if i.strip()]
+        for name, ingredients in zip(df["food_name"], df["ingredients"])
+    }
+
+
+class AllergenIndex:
+    """
+    Inverted index from normalized ingredient / dish terms to food row labels.
+    Excluding an allergy is a union of a few posting sets instead of a regex
+    scan of every dish name.
+    """
+
+    def __init__(self, foods, ingredients=None):
+        ingredients = load_ingredients() if ingredients is None else ingredients
+        self.postings = {}
+        self.missing_ingredients = []
+
+        for label, name in zip(foods.index, foods["food_name"]):
+            key = canonical_name(name)
+            items = ingredients.get(key)
+            if items is None:
+                self.missing_ingredients.append(name)
+                items = []
+            terms = set()
+            for phrase in items + [key]:
+                phrase = normalize_term(phrase)
+                terms.add(phrase)
+                terms.update(normalize_term(w) for w in phrase.split())
+            for term in terms:
+                self.postings.setdefault(term, set()).add(label)
+
+        self.foods = len(foods)
+        if self.missing_ingredients:
+            sample = ", ".join(self.missing_ingredients[:5])
+            print(f"⚠ {len(self.missing_ingredients)} of {self.foods} foods have no ingredient list "
+                  f"and are matched on their name only (e.g. {sample})")
+
+    def coverage(self, sample=20):
+        """How many foods have ingredient data, with a sample of those that do not."""
+        return {
+            "foods": self.foods,
+            "with_ingredients": self.foods - len(self.missing_ingredients),
+            "missing_ingredients": len(self.missing_ingredients),
+            "missing_sample": self.missing_ingredients[:sample]
+        }
+
+    def excluded(self, allergies):
+        """Row labels of every food containing any of the allergies."""
+        out = set()
+        for allergy in allergies:
+            for term in expand(allergy):
+                out |= self.postings.get(term, set())
+        return out
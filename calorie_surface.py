@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from model_registry import FEATURE_SCHEMA, ModelRegistry, normalize_features
+
+CATEGORICAL = FEATURE_SCHEMA["categorical"]   # gender, activity_level, target_goal
+NUMERIC = FEATURE_SCHEMA["numeric"]           # age, weight_kg, height_cm
+
+DEFAULT_RANGES = {"age": (18, 80), "weight_kg": (35, 160), "height_cm": (140, 210)}
+DEFAULT_STEPS = {"age": 1, "weight_kg": 2, "height_cm": 2}
+
+
+def model_categories(model):
+    """Category vocabularies the fitted pipeline's one-hot encoder knows."""
+    encoder = model.named_steps["pre"].named_transformers_["cat"]
+    return [list(c) for c in encoder.categories_]
+
+
+class CalorieSurface:
+    """
+    Calorie predictions precomputed on a dense (age, weight, height) grid for
+    every categorical combination, stored as one float32 array of shape
+    (n_combos, n_age, n_weight, n_height). predict() does trilinear
+    interpolation with array indexing only, so a batch of any size costs a
+    handful of vectorized numpy operations instead of a tree-ensemble pass.
+
+    Rows outside the grid or with unseen categories go to the exact model.
+    """
+
+    def __init__(self, grid, categories, axes, model_version=None, error=None, fallback=None):
+        self.grid = grid.astype(np.float32, copy=False)
+        self.categories = categories
+        self.axes = axes                  # {feature: 1-D array of grid points}
+        self.model_version = model_version
+        self.error = error or {}
+        self.fallback = fallback
+
+    # ---------------- Build ----------------
+    @classmethod
+    def build(cls, model, categories=None, ranges=None, steps=None, model_version=None,
+              batch_rows=2_000_000):
+        ranges = {**DEFAULT_RANGES, **(ranges or {})}
+        steps = {**DEFAULT_STEPS, **(steps or {})}
+        categories = categories or model_categories(model)
+        axes = {f: np.arange(ranges[f][0], ranges[f][1] + steps[f], steps[f], dtype=float)
+                for f in NUMERIC}
+
+        mesh = np.stack(np.meshgrid(*(axes[f] for f in NUMERIC), indexing="ij"), axis=-1)
+        points = pd.DataFrame(mesh.reshape(-1, 3), columns=NUMERIC)
+        combos = pd.MultiIndex.from_product(categories, names=CATEGORICAL).to_frame(index=False)
+
+        grid = np.empty((len(combos),) + mesh.shape[:3], dtype=np.float32)
+        per_combo = len(points)
+        batch_combos = max(1, batch_rows // per_combo)
+        for start in range(0, len(combos), batch_combos):
+            chunk = combos.iloc[start:start + batch_combos]
+            X = pd.concat(
+                [points.assign(**row._asdict()) for row in chunk.itertuples(index=False)],
+                ignore_index=True
+            )[NUMERIC + CATEGORICAL]
+            preds = np.asarray(model.predict(X), dtype=np.float32)
+            grid[start:start + len(chunk)] = preds.reshape((len(chunk),) + mesh.shape[:3])
+
+        return cls(grid, categories, axes, model_version=model_version, fallback=model)
+
+    def evaluate(self, model, n=20_000, seed=0):
+        """Max / mean absolute error against the exact model on random in-range profiles."""
+        rng = np.random.default_rng(seed)
+        X = pd.DataFrame({
+            "age": rng.integers(self.axes["age"][0], self.axes["age"][-1] + 1, n),
+            "weight_kg": rng.uniform(self.axes["weight_kg"][0], self.axes["weight_kg"][-1], n).round(1),
+            "height_cm": rng.uniform(self.axes["height_cm"][0], self.axes["height_cm"][-1], n).round(1),
+        })
+        for feature, values in zip(CATEGORICAL, self.categories):
+            X[feature] = rng.choice(values, n)
+        X = X[NUMERIC + CATEGORICAL]
+
+        delta = np.abs(self.lookup(X)[0] - np.asarray(model.predict(X), dtype=float))
+        self.error = {
+            "samples": n,
+            "max_abs_error": round(float(delta.max()), 2),
+            "mean_abs_error": round(float(delta.mean()), 3),
+            "p99_abs_error": round(float(np.percentile(delta, 99)), 2)
+        }
+        return self.error
+
+    # ---------------- Lookup ----------------
+    def combo_index(self, X):
+        X = normalize_features(X[CATEGORICAL])
+        idx = np.zeros(len(X), dtype=np.int64)
+        valid = np.ones(len(X), dtype=bool)
+        for feature, values in zip(CATEGORICAL, self.categories):
+            codes = pd.Categorical(X[feature], categories=values).codes.astype(np.int64)
+            valid &= codes >= 0
+            idx = idx * len(values) + codes
+        return idx, valid
+
+    def lookup(self, X):
+        """Interpolated predictions and a mask of rows the grid can answer."""
+        combo, valid = self.combo_index(X)
+        combo = np.where(valid, combo, 0)
+
+        lo_idx, frac = [], []
+        for feature in NUMERIC:
+            axis = self.axes[feature]
+            v = np.asarray(X[feature], dtype=float)
+            valid &= (v >= axis[0]) & (v <= axis[-1])
+            pos = np.clip((v - axis[0]) / (axis[1] - axis[0]), 0, len(axis) - 1)
+            i = np.minimum(pos.astype(np.int64), len(axis) - 2)
+            lo_idx.append(i)
+            frac.append(pos - i)
+
+        (a, w, h), (fa, fw, fh) = lo_idx, frac
+        g = self.grid
+        out = np.zeros(len(X))
+        for da in (0, 1):
+            wa = fa if da else 1 - fa
+            for dw in (0, 1):
+                ww = fw if dw else 1 - fw
+                for dh in (0, 1):
+                    wh = fh if dh else 1 - fh
+                    out += wa * ww * wh * g[combo, a + da, w + dw, h + dh]
+        return out, valid
+
+    def predict(self, X):
+        preds, valid = self.lookup(X)
+        if not valid.all():
+            if self.fallback is None:
+                raise ValueError("Profiles outside the calorie surface and no fallback model")
+            preds[~valid] = self.fallback.predict(normalize_features(X[~valid]))
+        return preds
+
+    # ---------------- Persistence ----------------
+    def save(self, path):
+        meta = {
+            "categories": self.categories,
+            "model_version": self.model_version,
+            "error": self.error
+        }
+        np.savez_compressed(
+            path, grid=self.grid, meta=json.dumps(meta),
+            **{f"axis_{f}": self.axes[f] for f in NUMERIC}
+        )
+
+    @classmethod
+    def load(cls, path, fallback=None):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            axes = {f: data[f"axis_{f}"] for f in NUMERIC}
+            grid = data["grid"]
+        return cls(grid, meta["categories"], axes, meta["model_version"], meta["error"], fallback)
+
+
+def surface_path(registry, version):
+    return os.path.join(registry.root, version, "surface.npz")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the calorie prediction surface")
+    parser.add_argument("--version", help="registry version (default: active)")
+    parser.add_argument("--age-step", type=float, default=DEFAULT_STEPS["age"])
+    parser.add_argument("--weight-step", type=float, default=DEFAULT_STEPS["weight_kg"])
+    parser.add_argument("--height-step", type=float, default=DEFAULT_STEPS["height_cm"])
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    version = args.version or registry.active_version()
+    if version is None:
+        raise SystemExit("No calorie model registered; run `python model_registry.py train` first")
+    model = registry.load(version)
+
+    surface = CalorieSurface.build(
+        model, model_version=version,
+        steps={"age": args.age_step, "weight_kg": args.weight_step, "height_cm": args.height_step}
+    )
+    print(json.dumps(surface.evaluate(model), indent=2))
+    surface.save(surface_path(registry, version))
+    print(f"Saved {surface.grid.shape} float32 grid ({surface.grid.nbytes / 1e6:.1f} MB) "
+          f"to {surface_path(registry, version)}")
@@ -0,0 +1,218 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.model_selection import KFold, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder
+from xgboost import XGBRegressor
+
+from meal_plan import calorie_training_frame
+from model_registry import FEATURE_SCHEMA, ModelRegistry
+
+# Offline training: never imported by the server.
+
+PARAM_GRID = {
+    "max_depth": [4, 6],
+    "learning_rate": [0.06, 0.1],
+    "min_child_weight": [1, 5]
+}
+BASE_PARAMS = {
+    "n_estimators": 2000,            # upper bound, early stopping picks the real count
+    "objective": "reg:squarederror",
+    "tree_method": "hist",
+    "early_stopping_rounds": 50
+}
+EARLY_STOPPING_FRACTION = 0.1      # of each training split, used only to stop boosting
+REPORT_DIR = "reports"
+
+
+# ---------------------------------------------------------
+# 1. DATA
+# ---------------------------------------------------------
+def read_profiles(path, chunksize=250_000):
+    """Read profile logs chunk by chunk, keeping only model columns."""
+    Xs, ys = [], []
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        X, y = calorie_training_frame(chunk)
+        X = X.astype({c: "category" for c in FEATURE_SCHEMA["categorical"]})
+        X = X.astype({c: "float32" for c in FEATURE_SCHEMA["numeric"]})
+        Xs.append(X)
+        ys.append(np.asarray(y, dtype=np.float32))
+    X = pd.concat(Xs, ignore_index=True)
+    for c in FEATURE_SCHEMA["categorical"]:
+        X[c] = X[c].astype(str)
+    return X, np.concatenate(ys)
+
+
+def make_preprocessor():
+    return ColumnTransformer(
+        transformers=[
+            ("cat", OneHotEncoder(handle_unknown="ignore"), FEATURE_SCHEMA["categorical"]),
+            ("num", "passthrough", FEATURE_SCHEMA["numeric"])
+        ]
+    )
+
+
+# ---------------------------------------------------------
+# 2. CROSS-VALIDATED SEARCH (process pool)
+# ---------------------------------------------------------
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    _worker_data["X"], _worker_data["y"] = X, y
+
+
+def _fit_fold(task):
+    """
+    Early stopping watches a slice of the training indices, so the fold's
+    validation rows only ever score the model.
+    """
+    params, train_idx, valid_idx, n_jobs, seed = task
+    X, y = _worker_data["X"], _worker_data["y"]
+    fit_idx, stop_idx = train_test_split(train_idx, test_size=EARLY_STOPPING_FRACTION,
+                                         random_state=seed)
+    model = XGBRegressor(**BASE_PARAMS, **params, n_jobs=n_jobs)
+    model.fit(X[fit_idx], y[fit_idx], eval_set=[(X[stop_idx], y[stop_idx])], verbose=False)
+    pred = model.predict(X[valid_idx])
+    return {
+        "params": params,
+        "rmse": float(np.sqrt(np.mean((pred - y[valid_idx]) ** 2))),
+        "best_iteration": int(model.best_iteration)
+    }
+
+
+def cross_validate(X_enc, y, folds=5, workers=None, param_grid=PARAM_GRID, seed=42):
+    """Every (params, fold) fit runs in its own process; cores are shared between them."""
+    workers = workers or min(os.cpu_count() or 1, 8)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    grid = [dict(zip(param_grid, values)) for values in itertools.product(*param_grid.values())]
+    splits = list(KFold(folds, shuffle=True, random_state=seed).split(X_enc))
+    tasks = [(params, tr, va, threads, seed) for params in grid for tr, va in splits]
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(X_enc, y)) as pool:
+        results = list(pool.map(_fit_fold, tasks))
+
+    summary = []
+    for params in grid:
+        runs = [r for r in results if r["params"] == params]
+        summary.append({
+            "params": params,
+            "cv_rmse": round(float(np.mean([r["rmse"] for r in runs])), 3),
+            "cv_rmse_std": round(float(np.std([r["rmse"] for r in runs])), 3),
+            "best_iteration": int(np.mean([r["best_iteration"] for r in runs]))
+        })
+    summary.sort(key=lambda s: s["cv_rmse"])
+    return summary
+
+
+# ---------------------------------------------------------
+# 3. FINAL FIT / CONTINUED TRAINING
+# ---------------------------------------------------------
+def fit_final(X, y, params, base=None, extra_rounds=200, valid_size=0.1, seed=42):
+    """
+    Fit on a train split with early stopping on a separate slice of it;
+    the reported metrics come from a holdout split never used for fitting
+    or stopping. With base (an existing pipeline) its encoder is reused and boosting
+    continues from its booster instead of starting over.
+    """
+    X_tr, X_va, y_tr, y_va = train_test_split(X, y, test_size=valid_size, random_state=seed)
+    X_tr, X_stop, y_tr, y_stop = train_test_split(X_tr, y_tr, test_size=EARLY_STOPPING_FRACTION,
+                                                  random_state=seed)
+
+    if base is None:
+        pre = make_preprocessor().fit(X_tr)
+        model = XGBRegressor(**BASE_PARAMS, **params, n_jobs=-1)
+        fit_kwargs = {}
+    else:
+        pre = base.named_steps["pre"]
+        old = base.named_steps["model"]
+        model = XGBRegressor(**{**old.get_params(), **BASE_PARAMS, **params,
+                                "n_estimators": extra_rounds, "n_jobs": -1})
+        fit_kwargs = {"xgb_model": old.get_booster()}
+
+    model.fit(pre.transform(X_tr), y_tr, eval_set=[(pre.transform(X_stop), y_stop)],
+              verbose=False, **fit_kwargs)
+
+    pipeline = Pipeline([("pre", pre), ("model", model)])
+    pred = pipeline.predict(X_va)
+    metrics = {
+        "holdout_rmse": round(float(np.sqrt(np.mean((pred - y_va) ** 2))), 3),
+        "holdout_mae": round(float(np.mean(np.abs(pred - y_va))), 3),
+        "best_iteration": int(model.best_iteration),
+        "rows": int(len(y))
+    }
+    return pipeline, metrics
+
+
+def run(csv_file, folds=5, workers=None, search=True, continue_from=None,
+        extra_rounds=200, activate=False, registry=None):
+    registry = registry or ModelRegistry()
+    timings = {}
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    X, y = read_profiles(csv_file)
+    timings["read_s"] = round(time.perf_counter() - t, 3)
+
+    base = registry.load(continue_from) if continue_from else None
+    cv = []
+    params = {k: v[0] for k, v in PARAM_GRID.items()}
+    if base is not None:
+        params = {k: base.named_steps["model"].get_params()[k] for k in PARAM_GRID}
+    elif search:
+        t = time.perf_counter()
+        X_enc = make_preprocessor().fit_transform(X)
+        cv = cross_validate(X_enc, y, folds=folds, workers=workers)
+        params = cv[0]["params"]
+        timings["cv_s"] = round(time.perf_counter() - t, 3)
+
+    t = time.perf_counter()
+    pipeline, metrics = fit_final(X, y, params, base=base, extra_rounds=extra_rounds)
+    timings["fit_s"] = round(time.perf_counter() - t, 3)
+    timings["total_s"] = round(time.perf_counter() - started, 3)
+
+    version = registry.register(
+        pipeline, training_data=csv_file, metrics=metrics,
+        params={**params, "continued_from": continue_from}
+    )
+    if activate:
+        registry.set_active(version)
+
+    report = {
+        "version": version,
+        "training_data": csv_file,
+        "continued_from": continue_from,
+        "params": params,
+        "metrics": metrics,
+        "cv": cv,
+        "timings": timings
+    }
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    with open(os.path.join(REPORT_DIR, f"calorie_training_{version}.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and register a calorie model")
+    parser.add_argument("csv", nargs="?", default="pakistan_user_profiles.csv")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-search", action="store_true", help="skip CV, use default params")
+    parser.add_argument("--continue-from", help="registry version to keep boosting from")
+    parser.add_argument("--extra-rounds", type=int, default=200)
+    parser.add_argument("--activate", action="store_true")
+    args = parser.parse_args()
+
+    report = run(args.csv, folds=args.folds, workers=args.workers, search=not args.no_search,
+                 continue_from=args.continue_from, extra_rounds=args.extra_rounds,
+                 activate=args.activate)
+    print(json.dumps({k: report[k] for k in ("version", "metrics", "timings")}, indent=2))
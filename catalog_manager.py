@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import traceback
+
+from meal_plan import load_food_data
+from exercise_plan import build_exercise_index
+from food_search import FoodSearchIndex
+from allergen_index import AllergenIndex, INGREDIENTS_PATH, load_ingredients
+
+
+class CatalogSnapshot:
+    """
+    One immutable version of every catalog the planners read.
+    Requests grab a snapshot once and use it to the end, so a swap never
+    changes data under an in-flight request.
+    """
+
+    def __init__(self, version, foods, exercises, signature, ingredients=None, food_path=None):
+        self.version = version
+        self.foods = foods
+        self.exercises = exercises
+        self.signature = signature
+        self.food_path = food_path
+        self.food_search = FoodSearchIndex(foods["food_name"])
+        self.allergens = AllergenIndex(foods, ingredients)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class CatalogManager:
+    """
+    Polls the food, exercise and ingredient files and rebuilds their indexes
+    on a background thread when any of them changes. The new snapshot
+    replaces the old one with a single reference assignment; listeners
+    registered with on_swap (plan caches, search indexes...) are told the
+    new version.
+
+    food_path may be a list of candidates: the first existing one is used and
+    re-resolved on every poll, so a compiled catalog that appears later
+    (python food_catalog.py) replaces the fallback without a restart.
+    """
+
+    def __init__(self, food_path, exercise_path="excercise.csv", poll_interval=5.0,
+                 ingredients_path=INGREDIENTS_PATH):
+        self.food_paths = [food_path] if isinstance(food_path, str) else list(food_path)
+        self.exercise_path = exercise_path
+        self.ingredients_path = ingredients_path
+        self.poll_interval = poll_interval
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = self._build(version=1)
+
+    def current(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def on_swap(self, callback):
+        """callback(snapshot) runs after every successful swap."""
+        self._listeners.append(callback)
+
+    @property
+    def food_path(self):
+        for path in self.food_paths:
+            if os.path.exists(path):
+                return path
+        return self.food_paths[-1]
+
+    def _signature(self):
+        food_path = self.food_path
+        return (food_path, _file_signature(food_path), _file_signature(self.exercise_path),
+                _file_signature(self.ingredients_path))
+
+    def _build(self, version):
+        signature = self._signature()
+        food_path = signature[0]
+        return CatalogSnapshot(
+            version=version,
+            foods=load_food_data(food_path),
+            exercises=build_exercise_index(self.exercise_path),
+            signature=signature,
+            ingredients=load_ingredients(self.ingredients_path),
+            food_path=food_path
+        )
+
+    def reload(self, force=False):
+        """
+        Rebuild if the files changed (or force=True). Returns True on swap.
+        A failed build keeps serving the previous snapshot.
+        """
+        with self._lock:
+            old = self._snapshot
+            if not force and self._signature() == old.signature:
+                return False
+            try:
+                new = self._build(version=old.version + 1)
+            except Exception:
+                print("⚠ Catalog reload failed, keeping version", old.version)
+                traceback.print_exc()
+                return False
+            self._snapshot = new
+
+        for callback in self._listeners:
+            try:
+                callback(new)
+            except Exception:
+                traceback.print_exc()
+        print(f"Catalog swapped to version {new.version} ({new.food_path})")
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._poll, name="catalog-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            # Skip files still being written: wait until they stop changing
+            before = self._signature()
+            if before == self._snapshot.signature:
+                continue
+            time.sleep(min(1.0, self.poll_interval))
+            if self._signature() == before:
+                self.reload()
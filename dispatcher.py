@@ -0,0 +1,610 @@
+import argparse
+import bisect
+import hashlib
+import http.client
+import json
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from loadtest import load_payloads, start_server, stop_server
+
+VIRTUAL_NODES = 160
+LOAD_FACTOR = 1.25
+# GET routes whose first path argument is a user id
+USER_PATHS = ("/profiles/", "/adherence/", "/trends/", "/exercise_history/")
+# Routes that read or write a user's IntakeAggregator window, which is cached
+# in the owner's process: never spilled, whatever the policy. (Plan targets
+# are read from the shared database on every query, so /meal_plan is not.)
+STATEFUL_PATHS = ("/intake_log", "/adherence/", "/trends/", "/exercise_video")
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length", "host"}
+# Safe to send twice; anything else is retried only if the worker never got it
+IDEMPOTENT_METHODS = {"GET", "HEAD"}
+# What a kept-alive connection the worker already closed fails with
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+# ---------------- Consistent hashing ----------------
+class ConsistentHashRing:
+    """
+    Hash ring with VIRTUAL_NODES points per worker. Adding or removing a
+    worker moves only the keys between its points and their predecessors
+    (about 1/n of all keys).
+
+    assign() applies bounded loads: a worker already holding more than
+    load_factor times the average in-flight requests is skipped, and the
+    key goes to the next distinct worker clockwise. One hot user therefore
+    spills over to a neighbour instead of queueing behind itself.
+    """
+
+    def __init__(self, workers=(), vnodes=VIRTUAL_NODES, load_factor=LOAD_FACTOR):
+        self.vnodes = vnodes
+        self.load_factor = load_factor
+        self._points = []   # sorted hashes
+        self._owners = []   # worker at each point
+        self._members = set()
+        for worker in workers:
+            self.add(worker)
+
+    @property
+    def workers(self):
+        return sorted(self._members)
+
+    def add(self, worker):
+        points = [(_hash(f"{worker}#{i}"), worker) for i in range(self.vnodes)]
+        self._members.add(worker)
+        merged = sorted(list(zip(self._points, self._owners)) + points)
+        self._points = [p for p, _ in merged]
+        self._owners = [w for _, w in merged]
+
+    def copy(self):
+        ring = ConsistentHashRing(vnodes=self.vnodes, load_factor=self.load_factor)
+        ring._points, ring._owners = list(self._points), list(self._owners)
+        ring._members = set(self._members)
+        return ring
+
+    def remove(self, worker):
+        self._members.discard(worker)
+        kept = [(p, w) for p, w in zip(self._points, self._owners) if w != worker]
+        self._points = [p for p, _ in kept]
+        self._owners = [w for _, w in kept]
+
+    def _walk(self, key):
+        """Distinct workers in clockwise order starting at key."""
+        if not self._points:
+            return
+        start = bisect.bisect(self._points, _hash(key))
+        seen = set()
+        n = len(self._points)
+        for i in range(n):
+            worker = self._owners[(start + i) % n]
+            if worker not in seen:
+                seen.add(worker)
+                yield worker
+
+    def lookup(self, key):
+        return next(self._walk(key), None)
+
+    def assign(self, key, loads):
+        """Owner of key, or the first worker clockwise below the load bound."""
+        workers = self._members
+        if not workers:
+            return None
+        total = sum(loads.get(w, 0) for w in workers) + 1
+        capacity = math.ceil(self.load_factor * total / len(workers))
+        for worker in self._walk(key):
+            if loads.get(worker, 0) < capacity:
+                return worker
+        return self.lookup(key)
+
+
+def routing_key(method, path, body):
+    """
+    "user:<id>" when the request names a user (JSON body, URL or query),
+    otherwise a hash of the canonical JSON body, so identical anonymous
+    profiles still land on the worker that cached their plan.
+    """
+    parts = urlsplit(path)
+    for prefix in USER_PATHS:
+        if parts.path.startswith(prefix):
+            rest = parts.path[len(prefix):].split("/")[0]
+            if rest and rest != "cohorts":
+                return f"user:{rest}"
+    user_id = parse_qs(parts.query).get("user_id")
+    if user_id:
+        return f"user:{user_id[0]}"
+    if method == "POST" and body:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if isinstance(payload, dict) and payload.get("user_id"):
+            return f"user:{payload['user_id']}"
+        # Workout event batches name one user (forward() splits the others)
+        events = payload.get("events") if isinstance(payload, dict) else payload
+        if isinstance(events, list) and events and isinstance(events[0], dict) \
+                and events[0].get("user_id"):
+            return f"user:{events[0]['user_id']}"
+        canonical = json.dumps(payload, sort_keys=True, default=str)
+        return f"profile:{hashlib.md5(canonical.encode()).hexdigest()}"
+    return None
+
+
+def split_event_batch(method, path, body):
+    """
+    One body per user for a workout event batch naming several users,
+    otherwise None. Each user's events must reach that user's owner.
+    """
+    if method != "POST" or urlsplit(path).path != "/exercise_video" or not body:
+        return None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None
+    events = payload.get("events") if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return None
+    groups = {}
+    for event in events:
+        # Left whole for the worker to reject
+        if not isinstance(event, dict) or not event.get("user_id"):
+            return None
+        groups.setdefault(str(event["user_id"]), []).append(event)
+    if len(groups) < 2:
+        return None
+    options = payload if isinstance(payload, dict) else {}
+    return [json.dumps({**options, "events": group}).encode() for group in groups.values()]
+
+
+def is_stateful(path, key):
+    """True when the request must reach the ring owner of its user."""
+    return bool(key) and key.startswith("user:") and urlsplit(path).path.startswith(STATEFUL_PATHS)
+
+
+# ---------------- Workers ----------------
+class Worker:
+    def __init__(self, name, url, proc=None):
+        self.name = name
+        self.url = url
+        self.proc = proc
+        self.inflight = 0
+        self.requests = 0
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port
+
+    def info(self):
+        return {"url": self.url, "pid": self.proc.pid if self.proc else None,
+                "inflight": self.inflight, "requests": self.requests}
+
+
+def _json_request(url, path, method="GET", payload=None):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    body = json.dumps(payload) if payload is not None else None
+    conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+    data = json.loads(conn.getresponse().read())
+    conn.close()
+    return data
+
+
+class Dispatcher:
+    """
+    Front process that proxies requests to N app worker processes.
+
+    policy="hash" routes by routing_key() on a ConsistentHashRing (bounded
+    loads); policy="round_robin" is the baseline. Requests on STATEFUL_PATHS
+    always go to the ring owner of their user, under either policy: the
+    owner caches the user's intake window, loaded from the shared event
+    database.
+
+    Workers can be added or removed while serving: a new worker joins the
+    ring only once it accepts connections, and a removed worker leaves the
+    ring first and is stopped after its in-flight requests finish. Either
+    way, once the requests routed under the old ring have finished, every
+    worker evicts the cached windows of users whose owner changed
+    (/intake_state/evict); the new owner rebuilds them from the database on
+    their next request. The plan cache is not moved: moved users miss it once.
+    """
+
+    def __init__(self, policy="hash", worker_cmd=None, load_factor=LOAD_FACTOR):
+        if policy not in ("hash", "round_robin"):
+            raise ValueError(f"Unknown policy: {policy}")
+        self.policy = policy
+        self.worker_cmd = worker_cmd
+        self.ring = ConsistentHashRing(load_factor=load_factor)
+        self.workers = {}
+        self._lock = threading.Lock()
+        self._next = 0
+        self._rr = 0
+        self._epoch = 0                  # bumped on every ring change
+        self._active = {}                # epoch -> requests routed under it, in flight
+        self._local = threading.local()
+
+    # -------- membership --------
+    def add_worker(self, url=None, env=None):
+        """Attach an existing worker url, or start one (worker_cmd / main.py)."""
+        with self._lock:
+            name = f"w{self._next}"
+            self._next += 1
+        proc = None
+        if url is None:
+            # The plan archive has a single writer per directory
+            env = {"PLAN_ARCHIVE_DIR": os.path.join("data", "plan_archive", name), **(env or {})}
+            proc, url = start_server(self.worker_cmd, env={k: str(v) for k, v in env.items()})
+        worker = Worker(name, url, proc)
+        with self._lock:
+            old_ring = self.ring.copy()
+            self.workers[name] = worker
+            self.ring.add(name)
+            epoch = self._bump_epoch()
+        self._hand_off(old_ring, epoch)
+        return name
+
+    def remove_worker(self, name, drain_timeout=30.0):
+        with self._lock:
+            worker = self.workers.get(name)
+            if worker is None:
+                raise KeyError(f"No worker {name}")
+            old_ring = self.ring.copy()
+            self.ring.remove(name)
+            epoch = self._bump_epoch()
+        deadline = time.time() + drain_timeout
+        while worker.inflight and time.time() < deadline:
+            time.sleep(0.05)
+        self._hand_off(old_ring, epoch, drain_timeout)
+        with self._lock:
+            del self.workers[name]
+        if worker.proc is not None:
+            stop_server(worker.proc)
+
+    def close(self, drain_timeout=5.0):
+        """Stop all workers. No handoff: there is no one left to take the state."""
+        with self._lock:
+            workers = list(self.workers.values())
+            for worker in workers:
+                self.ring.remove(worker.name)
+        deadline = time.time() + drain_timeout
+        while any(w.inflight for w in workers) and time.time() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            self.workers.clear()
+        for worker in workers:
+            if worker.proc is not None:
+                stop_server(worker.proc)
+
+    # -------- state handoff --------
+    def _bump_epoch(self):
+        """Called with the lock held after the ring changed."""
+        self._epoch += 1
+        return self._epoch
+
+    def _wait_for_epoch(self, epoch, timeout):
+        """Wait until no request routed under a ring older than epoch is in flight."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if not any(n for e, n in self._active.items() if e < epoch):
+                    return True
+            time.sleep(0.05)
+        return False
+
+    def _hand_off(self, old_ring, epoch, timeout=30.0):
+        """Evict cached intake windows of users whose ring owner changed since old_ring."""
+        if not self._wait_for_epoch(epoch, timeout):
+            print("⚠ Requests routed before the ring change are still running; handing off anyway")
+        with self._lock:
+            workers = [self.workers[n] for n in self.ring.workers]
+        for worker in workers:
+            try:
+                cached = _json_request(worker.url, "/intake_state")["user_ids"]
+                with self._lock:
+                    stale = [u for u in cached
+                             if self.ring.lookup(f"user:{u}") != worker.name
+                             or old_ring.lookup(f"user:{u}") != worker.name]
+                if stale:
+                    _json_request(worker.url, "/intake_state/evict", "POST", {"user_ids": stale})
+            except (OSError, http.client.HTTPException, ValueError, KeyError) as e:
+                print(f"⚠ Intake cache handoff on {worker.name} failed: {e}")
+
+    # -------- routing --------
+    def choose(self, key, stateful=False):
+        with self._lock:
+            # Draining workers are already off the ring
+            names = self.ring.workers
+            if not names:
+                raise RuntimeError("No workers available")
+            if stateful:
+                name = self.ring.lookup(key)
+            elif self.policy == "round_robin" or key is None:
+                name = names[self._rr % len(names)]
+                self._rr += 1
+            else:
+                loads = {n: w.inflight for n, w in self.workers.items()}
+                name = self.ring.assign(key, loads)
+            worker = self.workers[name]
+            worker.inflight += 1
+            worker.requests += 1
+            self._active[self._epoch] = self._active.get(self._epoch, 0) + 1
+            return worker, self._epoch
+
+    def _connection(self, worker):
+        pool = getattr(self._local, "conns", None)
+        if pool is None:
+            pool = self._local.conns = {}
+        conn = pool.get(worker.name)
+        if conn is None:
+            conn = pool[worker.name] = http.client.HTTPConnection(worker.host, worker.port, timeout=120)
+        return conn
+
+    def forward(self, method, path, headers, body):
+        """
+        Returns (status, headers, body) from the chosen worker. A workout
+        event batch naming several users is split and each part sent to its
+        user's owner; the first failed part is returned as is (event_ids
+        make resending the whole batch safe), otherwise the event_ids of all
+        parts with the weakest acknowledgement (202 over 201).
+        """
+        parts = split_event_batch(method, path, body)
+        if parts is None:
+            return self._forward(method, path, headers, body)
+        responses = [self._forward(method, path, headers, part) for part in parts]
+        for response in responses:
+            if response[0] >= 400:
+                return response
+        status, resp_headers, resp_body = max(responses, key=lambda r: r[0])
+        ids = [i for r in responses for i in json.loads(r[2]).get("event_ids", [])]
+        return status, resp_headers, json.dumps({**json.loads(resp_body), "event_ids": ids}).encode()
+
+    def _forward(self, method, path, headers, body):
+        """
+        One request to the chosen worker. A failed
+        request is retried once, on the key's next owner if the worker died,
+        and only when that cannot run it twice: GET / HEAD, a connection
+        that was never established, or a stale kept-alive connection.
+        Timeouts and resets of other requests go back to the client as 502.
+        """
+        key = routing_key(method, path, body)
+        stateful = is_stateful(path, key)
+        for attempt in range(2):
+            worker, epoch = self.choose(key, stateful)
+            conn = self._connection(worker)
+            reused = conn.sock is not None
+            sent = False
+            try:
+                if not reused:
+                    conn.connect()
+                sent = True
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                return resp.status, resp.getheaders(), resp.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                self._local.conns.pop(worker.name, None)
+                # Worker died: take it off the ring so its keys go to the successor
+                if worker.proc is not None and worker.proc.poll() is not None:
+                    with self._lock:
+                        self.ring.remove(worker.name)
+                        self.workers.pop(worker.name, None)
+                        self._bump_epoch()
+                retryable = (method in IDEMPOTENT_METHODS or not sent
+                             or (reused and isinstance(e, STALE_CONNECTION_ERRORS)))
+                if attempt == 1 or not retryable:
+                    raise
+            finally:
+                with self._lock:
+                    worker.inflight -= 1
+                    self._active[epoch] -= 1
+                    if not self._active[epoch] and epoch != self._epoch:
+                        del self._active[epoch]
+
+    def status(self):
+        with self._lock:
+            return {"policy": self.policy,
+                    "workers": {n: w.info() for n, w in sorted(self.workers.items())}}
+
+
+# ---------------- HTTP front ----------------
+def make_server(dispatcher, host="127.0.0.1", port=8000):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, headers, body):
+            self.send_response(status)
+            for name, value in headers:
+                if name.lower() not in HOP_HEADERS:
+                    self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, status, payload):
+            self._reply(status, [("Content-Type", "application/json")], json.dumps(payload).encode())
+
+        def _admin(self, method, body):
+            path = urlsplit(self.path).path
+            if method == "GET" and path == "/_dispatcher":
+                return self._json(200, dispatcher.status())
+            if method == "POST" and path == "/_dispatcher/workers":
+                url = (json.loads(body) if body else {}).get("url")
+                return self._json(201, {"added": dispatcher.add_worker(url)})
+            if method == "DELETE" and path.startswith("/_dispatcher/workers/"):
+                name = path.rsplit("/", 1)[1]
+                try:
+                    dispatcher.remove_worker(name)
+                except KeyError as e:
+                    return self._json(404, {"status": "error", "message": e.args[0]})
+                return self._json(200, {"removed": name})
+            return self._json(404, {"status": "error", "message": "Unknown dispatcher route"})
+
+        def _handle(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+            if self.path.startswith("/_dispatcher"):
+                return self._admin(method, body)
+            headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_HEADERS}
+            try:
+                self._reply(*dispatcher.forward(method, self.path, headers, body))
+            except Exception as e:
+                self._json(502, {"status": "error", "message": f"Worker unavailable: {e}"})
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_DELETE(self):
+            self._handle("DELETE")
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+# ---------------- Benchmark ----------------
+def bench_requests(n_requests, n_users, zipf=1.1, seed=0):
+    """
+    (endpoint, body) pairs: users drawn with Zipf popularity, each user
+    sending their own meal / exercise payloads (3:2), as a returning user would.
+    """
+    rng = np.random.default_rng(seed)
+    payloads = load_payloads()
+    n_users = min(n_users, len(payloads["meal_plan"]))
+    weights = 1.0 / np.arange(1, n_users + 1) ** zipf
+    users = rng.choice(n_users, size=n_requests, p=weights / weights.sum())
+    out = []
+    for u in users:
+        endpoint = "meal_plan" if rng.random() < 0.6 else "exercise_plan"
+        out.append((endpoint, {**payloads[endpoint][u], "user_id": f"bench-{u}"}))
+    return out
+
+
+def run_bench(workers, policy, requests, concurrency, cache_entries):
+    dispatcher = Dispatcher(policy=policy)
+    env = {"PLAN_CACHE_ENTRIES": cache_entries, "PROFILES_DB": "/tmp/nutrifit_bench/profiles.db",
+           "WORKOUT_EVENTS_DB": "/tmp/nutrifit_bench/events.db"}
+    os.makedirs("/tmp/nutrifit_bench", exist_ok=True)
+    for i in range(workers):
+        dispatcher.add_worker(env={**env, "PLAN_ARCHIVE_DIR": f"/tmp/nutrifit_bench/archive-{i}"})
+    server = make_server(dispatcher, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    local = threading.local()
+
+    def send(item):
+        endpoint, body = item
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        started = time.perf_counter()
+        conn.request("POST", f"/{endpoint}", body=json.dumps(body),
+                      headers={"Content-Type": "application/json"})
+        resp = conn.getresponse()
+        resp.read()
+        return time.perf_counter() - started, resp.status < 400
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(send, requests))
+        elapsed = time.perf_counter() - started
+        hits = misses = 0
+        for worker in dispatcher.workers.values():
+            stats = _json_request(worker.url, "/cache_stats")["plan_cache"]
+            hits += stats["hits"]
+            misses += stats["misses"]
+    finally:
+        server.shutdown()
+        dispatcher.close()
+
+    latency = np.array([r[0] for r in results]) * 1000
+    return {
+        "workers": workers,
+        "policy": policy,
+        "requests": len(results),
+        "rps": round(len(results) / elapsed, 1),
+        "error_rate": round(sum(1 for r in results if not r[1]) / len(results), 4),
+        "cache_hit_rate": round(hits / max(1, hits + misses), 4),
+        "p50_ms": round(float(np.percentile(latency, 50)), 2),
+        "p99_ms": round(float(np.percentile(latency, 99)), 2)
+    }
+
+
+def bench(worker_counts, requests, users, concurrency, cache_entries, output=None):
+    items = bench_requests(requests, users)
+    report = {"requests": requests, "users": users, "concurrency": concurrency,
+              "cache_entries_per_worker": cache_entries, "runs": []}
+    for n in worker_counts:
+        for policy in ("round_robin", "hash"):
+            run = run_bench(n, policy, items, concurrency, cache_entries)
+            report["runs"].append(run)
+            print(f"workers={n} {policy:<11} hit_rate={run['cache_hit_rate']:.3f} "
+                  f"p50={run['p50_ms']}ms p99={run['p99_ms']}ms rps={run['rps']}")
+
+    output = output or os.path.join("reports", f"dispatcher_bench_{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User-affinity dispatcher in front of NutriFit worker processes")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="start N workers behind the dispatcher")
+    serve.add_argument("--workers", type=int, default=4)
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--policy", choices=["hash", "round_robin"], default="hash")
+    serve.add_argument("--worker-cmd", help="command to start a worker; {port} is substituted")
+    serve.add_argument("--load-factor", type=float, default=LOAD_FACTOR)
+
+    b = sub.add_parser("bench", help="cache hit rate and p99 vs round-robin as workers scale")
+    b.add_argument("--workers", default="1,2,4")
+    b.add_argument("--requests", type=int, default=3000)
+    b.add_argument("--users", type=int, default=600)
+    b.add_argument("--concurrency", type=int, default=8)
+    b.add_argument("--cache-entries", type=int, default=300, help="plan cache size per worker")
+    b.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench([int(n) for n in args.workers.split(",")], args.requests, args.users,
+              args.concurrency, args.cache_entries, args.output)
+        return
+
+    dispatcher = Dispatcher(args.policy, args.worker_cmd, args.load_factor)
+    for _ in range(args.workers):
+        print("Started worker", dispatcher.add_worker())
+    server = make_server(dispatcher, args.host, args.port)
+    print(f"Dispatching on {args.host}:{args.port} ({args.policy}, {args.workers} workers)")
+    # Stop the workers on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        dispatcher.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,20 +4,104 @@ from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.metrics.pairwise import cosine_similarity
 import random
 import hashlib
+import itertools
+from collections import deque
 
 # ---------------- Load Dataset ----------------
-exercise_df = pd.read_csv('excercise.csv')
-
 categorical_features = ['muscle_group', 'type', 'intensity']
 numerical_features = ['sets', 'repetitions', 'duration']
 
-encoder = OneHotEncoder()
-X_cat = encoder.fit_transform(exercise_df[categorical_features])
 
-scaler = StandardScaler()
-X_num = scaler.fit_transform(exercise_df[numerical_features])
+def build_exercise_index(path='excercise.csv'):
+    """
+    Load the exercise catalog and its feature matrix.
+    The returned dict is never mutated, so it can be swapped in as a whole.
+    """
+    df = pd.read_csv(path)
+
+    encoder = OneHotEncoder()
+    X_cat = encoder.fit_transform(df[categorical_features])
+
+    scaler = StandardScaler()
+    X_num = scaler.fit_transform(df[numerical_features])
+
+    X = np.hstack([X_cat.toarray(), X_num])
+    neighbors, neighbor_scores = build_neighbor_table(X)
+    muscle_groups, muscle_bits = build_muscle_bitsets(df['muscle_group'])
+
+    return {
+        'exercise_df': df,
+        'encoder': encoder,
+        'scaler': scaler,
+        'X_num': X_num,
+        'X_final': X,
+        'neighbors': neighbors,
+        'neighbor_scores': neighbor_scores,
+        'name_to_row': {name.lower(): i for i, name in enumerate(df['exercise_name'])},
+        'muscle_groups': muscle_groups,
+        'muscle_bits': muscle_bits
+    }
+
+
+def split_muscle_groups(label):
+    """'Core/Full Body' -> ['core', 'full body']"""
+    return [m.strip().lower() for m in str(label).split('/') if m.strip()]
+
+
+def build_muscle_bitsets(labels):
+    """
+    One bit per muscle group; an exercise's bitset has the bits of every
+    group it trains. Returns (group names by bit, uint32 bitset per row).
+    """
+    groups = sorted({m for label in labels for m in split_muscle_groups(label)})
+    if len(groups) > 32:
+        raise ValueError("At most 32 muscle groups are supported")
+    bit = {m: 1 << i for i, m in enumerate(groups)}
+    bits = np.array([sum(bit[m] for m in split_muscle_groups(label)) for label in labels],
+                    dtype=np.uint32)
+    return groups, bits
+
+
+def muscle_mask(groups, muscles):
+    """Bitset of the requested muscle names (unknown names are ignored)."""
+    mask = 0
+    for name in muscles:
+        for m in split_muscle_groups(name):
+            if m in groups:
+                mask |= 1 << groups.index(m)
+    return mask
+
+
+def build_neighbor_table(X, k=32, block=1024):
+    """
+    Top-k most similar exercises (cosine over X_final) for every exercise,
+    computed block by block so memory stays at block x n.
+    Returns row ids (n, k) and their similarities, best first.
+    """
+    n = X.shape[0]
+    k = min(k, n - 1)
+    neighbors = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+
+    for start in range(0, n, block):
+        sim = cosine_similarity(X[start:start + block], X)
+        rows = np.arange(sim.shape[0])
+        sim[rows, start + rows] = -np.inf          # never suggest the exercise itself
+        top = np.argpartition(-sim, k - 1, axis=1)[:, :k]
+        top_sim = np.take_along_axis(sim, top, axis=1)
+        order = np.argsort(-top_sim, axis=1)
+        neighbors[start:start + block] = np.take_along_axis(top, order, axis=1)
+        scores[start:start + block] = np.take_along_axis(top_sim, order, axis=1)
+
+    return neighbors, scores
 
-X_final = np.hstack([X_cat.toarray(), X_num])
+
+_default_index = build_exercise_index()
+exercise_df = _default_index['exercise_df']
+encoder = _default_index['encoder']
+scaler = _default_index['scaler']
+X_num = _default_index['X_num']
+X_final = _default_index['X_final']
 
 # ---------------- Activity Level Mapping ----------------
 def map_activity_level(activity_level):
@@ -46,6 +130,12 @@ def create_user_vector(user_profile):
 def adjust_exercise(row, activity, target_goal, timeline_weeks):
 
     sets, reps, duration = row['sets'], row['repetitions'], row['duration']
+    sets, reps, duration = _scale_volume(sets, reps, duration, activity, target_goal, timeline_weeks)
+    return pd.Series([round(sets), round(reps), round(duration)])
+
+
+def _scale_volume(sets, reps, duration, activity, target_goal, timeline_weeks):
+    """Shared by adjust_exercise (one row) and generate_exercise_plan (whole columns)."""
 
     # Activity adjustment
     activity = map_activity_level(activity)
@@ -75,21 +165,100 @@ def adjust_exercise(row, activity, target_goal, timeline_weeks):
         reps *= 1.05
         duration *= 1.05
 
-    return pd.Series([round(sets), round(reps), round(duration)])
+    return sets, reps, duration
+
+# ---------------- Weekly Split Scheduler ----------------
+MAX_EXERCISES_PER_DAY = 8     # a session longer than this is not a plan anyone follows
+SCHEDULER_LOOKAHEAD = 4       # rows scored per muscle bitset on each pick
+
+
+def schedule_exercises(bits, volume, days, per_day, coverage_mask, recovery_days=1,
+                       lookahead=SCHEDULER_LOOKAHEAD):
+    """
+    Assign exercises (rows of bits / volume) to days, greedily, one pick at a time:
+
+    - a group trained in the last recovery_days days is avoided (relaxed only
+      when nothing else is left),
+    - groups in coverage_mask that the week has not hit yet come first,
+    - exercises are not repeated within a day and repeated across the week
+      only after the rest of their bucket was used,
+    - each day's volume is kept close to an equal share of the week.
+
+    Exercises with the same muscle bitset score the same on coverage and
+    recovery, so they are bucketed by bitset, least used first (input order
+    breaks ties). A pick only scores the first `lookahead` rows of each
+    bucket: O(buckets * lookahead), independent of the catalog size.
+    Returns row ids per day.
+    """
+    bits = np.asarray(bits, dtype=np.int64)
+    volume = np.asarray(volume, dtype=float)
+    n = len(bits)
+    codes, inverse = np.unique(bits, return_inverse=True)
+    buckets = [deque(np.flatnonzero(inverse == b).tolist()) for b in range(len(codes))]
+    codes = [int(c) for c in codes]
+    used = [0] * n
+    covered = 0
+    history = []                              # group bitset trained per day
+    day_target = max(volume.mean() * per_day, 1.0) if n else 1.0
+
+    schedule = []
+    for day in range(days):
+        recent = 0
+        for trained in history[-recovery_days:] if recovery_days else []:
+            recent |= trained
+        picked, today, day_bits, day_volume = [], set(), 0, 0.0
+
+        for _ in range(min(per_day, n)):
+            uncovered = coverage_mask & ~covered
+            best = None
+            for b, code in enumerate(codes):
+                group_score = (
+                    100.0 * bin(code & uncovered).count("1")
+                    + 10.0 * bool(code & coverage_mask)
+                    - 1000.0 * bool(code & recent & ~day_bits)
+                )
+                for j, i in enumerate(itertools.islice(buckets[b], lookahead)):
+                    if i in today:
+                        continue
+                    score = (group_score - 50.0 * used[i]
+                             - abs(day_volume + volume[i] - day_target) / day_target)
+                    if best is None or score > best[0] or (score == best[0] and i < best[1]):
+                        best = (score, i, b, j)
+            if best is None:
+                break
+            _, i, b, j = best
+            # Least used first: the pick moves to the back of its bucket
+            del buckets[b][j]
+            buckets[b].append(i)
+            picked.append(i)
+            today.add(i)
+            used[i] += 1
+            day_bits |= codes[b]
+            covered |= codes[b]
+            day_volume += volume[i]
+
+        history.append(day_bits)
+        schedule.append(picked)
+    return schedule
+
 
 # ---------------- Generate Daily Exercise Plan ----------------
-def generate_exercise_plan(user_profile, days=7):
+def generate_exercise_plan(user_profile, days=7, exercise_index=None):
     """
     Generate a deterministic daily workout plan.
     Ensure there are no fallback random exercises; handle the 'no exercises found' case explicitly.
     Minimum 3 exercises per day.
+    exercise_index comes from build_exercise_index (defaults to the one loaded at import).
     """
     goal = user_profile['target_goal'].lower()
     activity = user_profile['activity_level'].lower()
     timeline = user_profile['timeline_weeks']
+    index = exercise_index or _default_index
+    df = index['exercise_df']
 
     # Filter exercises by goal
-    filtered_ex = exercise_df[exercise_df['target_goal'].str.lower() == goal].copy()
+    in_goal = (df['target_goal'].str.lower() == goal).to_numpy()
+    filtered_ex = df[in_goal].copy()
 
     # Handle the case where no exercises are found for the target goal
     if filtered_ex.empty:
@@ -97,27 +266,40 @@ def generate_exercise_plan(user_profile, days=7):
         # Option 1: Return an empty plan with a message
         return {"error": f"No exercises found for goal '{goal}'. Please update your goal or try a different one."}
 
+    # Selected muscles must be covered: borrow exercises from other goals
+    # for any selected group the goal has none for
+    groups, all_bits = index['muscle_groups'], index['muscle_bits']
+    selected = muscle_mask(groups, user_profile.get('muscles') or [])
+    goal_groups = int(np.bitwise_or.reduce(all_bits[in_goal]))
+    missing = selected & ~goal_groups
+    if missing:
+        borrowed = ~in_goal & ((all_bits & missing) != 0)
+        filtered_ex = pd.concat([filtered_ex, df[borrowed]])
+    coverage = selected or goal_groups
+    filtered_ex['_bits'] = all_bits[filtered_ex.index.to_numpy()]
+
     # Adjust exercises based on the user profile
-    filtered_ex[['sets', 'repetitions', 'duration']] = filtered_ex.apply(
-        lambda row: adjust_exercise(row, activity, goal, timeline), axis=1)
+    sets, reps, duration = _scale_volume(
+        filtered_ex['sets'].to_numpy(float), filtered_ex['repetitions'].to_numpy(float),
+        filtered_ex['duration'].to_numpy(float), activity, goal, timeline)
+    filtered_ex['sets'] = np.round(sets).astype(int)
+    filtered_ex['repetitions'] = np.round(reps).astype(int)
+    filtered_ex['duration'] = np.round(duration).astype(int)
 
     # ---------------- Deterministic Shuffle ----------------
     # Use a hash of the user profile as a seed for deterministic shuffling
     user_hash = int(hashlib.md5(str(user_profile).encode()).hexdigest(), 16) % (2**32)
     filtered_ex = filtered_ex.sample(frac=1, random_state=user_hash).reset_index(drop=True)
 
-    # Determine exercises per day
-    exercises_per_day = max(3, len(filtered_ex) // days)
+    # Determine exercises per day (3 to MAX_EXERCISES_PER_DAY)
+    exercises_per_day = min(MAX_EXERCISES_PER_DAY, max(3, len(filtered_ex) // days))
+    schedule = schedule_exercises(
+        filtered_ex['_bits'].to_numpy(), filtered_ex['duration'].to_numpy(),
+        days, exercises_per_day, coverage)
     daily_plan = {}
 
-    for day in range(1, days + 1):
-        start_idx = (day - 1) * exercises_per_day
-        end_idx = start_idx + exercises_per_day
-        day_ex = filtered_ex.iloc[start_idx:end_idx]
-
-        # Ensure at least 3 exercises per day
-        if len(day_ex) < 3:
-            day_ex = filtered_ex.iloc[:3]
+    for day, rows in enumerate(schedule, start=1):
+        day_ex = filtered_ex.iloc[rows]
 
         # Add day's exercises to plan
         daily_plan[f'Day {day}'] = day_ex[['exercise_name', 'sets', 'repetitions', 'duration']].to_dict(
@@ -125,3 +307,63 @@ def generate_exercise_plan(user_profile, days=7):
         )
 
     return daily_plan
+
+
+# ---------------- Exercise Substitution ----------------
+def find_substitutes(exercise_name, goal=None, muscle_groups=None, k=5, exercise_index=None):
+    """
+    Alternatives for one exercise from the precomputed neighbor table,
+    optionally restricted to a goal and to the muscle groups available.
+    When the filters leave fewer than k of the table's neighbors, the rest
+    come from a scan of the whole catalog. Returns None for an unknown exercise.
+    """
+    index = exercise_index or _default_index
+    row = index['name_to_row'].get(str(exercise_name).strip().lower())
+    if row is None:
+        return None
+
+    df = index['exercise_df']
+    # Compound labels ("Core/Full Body") match any of their groups
+    groups = muscle_mask(index['muscle_groups'], muscle_groups) if muscle_groups else None
+    goal = goal.lower() if goal else None
+
+    def allowed(i):
+        if goal and df['target_goal'].iat[i].lower() != goal:
+            return False
+        return groups is None or bool(int(index['muscle_bits'][i]) & groups)
+
+    picks = []
+    for i, score in zip(index['neighbors'][row], index['neighbor_scores'][row]):
+        if allowed(i):
+            picks.append((int(i), float(score)))
+            if len(picks) == k:
+                break
+
+    if len(picks) < k:
+        # The filters removed too many neighbors: score the whole catalog
+        keep = np.ones(len(df), dtype=bool)
+        if goal:
+            keep &= (df['target_goal'].str.lower() == goal).to_numpy()
+        if groups is not None:
+            keep &= (np.asarray(index['muscle_bits'], dtype=np.int64) & groups) != 0
+        keep[row] = False
+        keep[[i for i, _ in picks]] = False
+        candidates = np.flatnonzero(keep)
+        sim = cosine_similarity(index['X_final'][row:row + 1], index['X_final'][candidates])[0]
+        best = np.argsort(-sim, kind='stable')[:k - len(picks)]
+        picks += [(int(candidates[j]), float(sim[j])) for j in best]
+
+    substitutes = []
+    for i, score in picks:
+        candidate = df.iloc[i]
+        substitutes.append({
+            'exercise_name': candidate['exercise_name'],
+            'muscle_group': candidate['muscle_group'],
+            'type': candidate['type'],
+            'intensity': candidate['intensity'],
+            'sets': int(candidate['sets']),
+            'repetitions': int(candidate['repetitions']),
+            'duration': int(candidate['duration']),
+            'similarity': round(score, 3)
+        })
+    return substitutes
@@ -1,16 +1,39 @@
 from flask import request, jsonify
 
+from workout_events import BufferFull, validate_event
 
-def handle_exercise_video():
+DURABLE_ACK_TIMEOUT = 2.0  # seconds
 
-    data = request.get_json()
+
+def handle_exercise_video(event_store):
+    """
+    Record workout-completion events: a single event object or {"events": [...]}.
+    Events are acknowledged once buffered (202); with "durable": true (or
+    ?durable=1) the response waits until their batch is committed (201).
+    """
+    data = request.get_json(silent=True)
 
     if not data:
         return jsonify({"status": "error", "message": "No data received"}), 400
 
-    # Print the received data
-    print("Received Exercise Video Data:")
-    print(data)
+    raw_events = data.get("events", [data]) if isinstance(data, dict) else data
+    try:
+        events = [validate_event(e) for e in raw_events]
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    try:
+        batch = event_store.append(events)
+    except BufferFull as e:
+        response = jsonify({"status": "error", "message": str(e)})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    ids = [e["event_id"] for e in events]
+    durable = request.args.get("durable") == "1" or (isinstance(data, dict) and data.get("durable"))
+    if not durable:
+        return jsonify({"status": "accepted", "message": "Data received", "event_ids": ids}), 202
 
-    # You can later add code to save this data to a database
-    return jsonify({"status": "success", "message": "Data received"}), 200
+    if not batch.done.wait(DURABLE_ACK_TIMEOUT) or batch.error is not None:
+        return jsonify({"status": "error", "message": "Events not yet persisted, retry with the same event_ids"}), 503
+    return jsonify({"status": "success", "message": "Data saved", "event_ids": ids}), 201
@@ -0,0 +1,320 @@
+import argparse
+import os
+import random
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+
+import numpy as np
+
+FIRESTORE_PROJECT = "nutrifit-2"  # projectId in firebase.json
+MAX_BATCH_WRITES = 500            # Firestore limit per batched write
+MAX_ATTEMPTS = 5                  # failed single-document writes (while others succeed) before dead-lettering
+DEAD_LETTER_SAMPLE = 20           # dead-lettered documents kept for /sync_metrics
+# Raised by the Firestore client before anything is sent (bad document
+# path, unserializable value): retrying the same document cannot succeed.
+PERMANENT_ERRORS = (ValueError, TypeError)
+
+PROFILES_COLLECTION = "users"
+MEAL_PLANS_COLLECTION = "meal_plans"
+EXERCISE_PLANS_COLLECTION = "exercise_plans"
+# A new plan replaces the whole document, so keys of an older plan (solver,
+# macro_miss...) do not linger; profile documents are merged field by field
+OVERWRITE_COLLECTIONS = {MEAL_PLANS_COLLECTION, EXERCISE_PLANS_COLLECTION}
+
+
+def _combine(collection, older, newer):
+    return newer if collection in OVERWRITE_COLLECTIONS else {**older, **newer}
+
+
+# ---------------- Writers ----------------
+class FirestoreWriter:
+    """
+    Commits (collection, doc_id, data) writes as one Firestore batch.
+    google-cloud-firestore is imported on first use. When
+    FIRESTORE_EMULATOR_HOST is set the client talks to the local emulator
+    without credentials.
+    """
+
+    def __init__(self, project=None):
+        self.project = project or os.environ.get("FIRESTORE_PROJECT", FIRESTORE_PROJECT)
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            from google.cloud import firestore
+            self._client = firestore.Client(project=self.project)
+        return self._client
+
+    def commit(self, writes):
+        client = self._get_client()
+        batch = client.batch()
+        for collection, doc_id, data in writes:
+            batch.set(client.collection(collection).document(doc_id), data,
+                      merge=collection not in OVERWRITE_COLLECTIONS)
+        batch.commit()
+
+
+class MemoryWriter:
+    """
+    In-process stand-in for Firestore, with optional injected failures and
+    latency. Like Firestore, it rejects the whole batch when a doc_id has "/".
+    """
+
+    def __init__(self, failure_rate=0.0, latency=0.0, seed=0):
+        self.docs = {}
+        self.commits = 0
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self._rng = random.Random(seed)
+
+    def commit(self, writes):
+        time.sleep(self.latency)
+        if self._rng.random() < self.failure_rate:
+            raise ConnectionError("Injected write failure")
+        for collection, doc_id, _ in writes:
+            if "/" in doc_id:
+                raise ValueError(f"Invalid document id {doc_id!r}")
+        for collection, doc_id, data in writes:
+            self.docs[(collection, doc_id)] = _combine(collection, self.docs.get((collection, doc_id), {}), data)
+        self.commits += 1
+
+
+# ---------------- Write-behind queue ----------------
+class FirebaseSync:
+    """
+    Write-behind sync from the API to Firestore.
+
+    enqueue() only updates an in-memory dict keyed by (collection, doc_id),
+    so repeated writes to one user's document before a flush collapse into
+    one write. A background thread sends up to batch_size documents per
+    batched write every flush_interval seconds (or as soon as a batch is
+    full). When max_pending documents are waiting, new ones are dropped and
+    counted rather than blocking the request.
+
+    A failed batch goes back in the queue under any newer writes and is
+    bisected: the next batches are half its size, growing back after each
+    success, so one bad document (a doc_id with "/", a value Firestore
+    rejects) only holds back itself. A document that fails on its own is
+    moved behind the rest of the queue and retried with capped exponential
+    backoff and jitter. Such a failure counts as an attempt only if some
+    other batch was written since the document was queued or last failed,
+    so an outage, where nothing gets through, dead-letters nothing. After
+    max_attempts counted failures (or the first one in PERMANENT_ERRORS)
+    the document is dropped and counted as dead-lettered.
+    """
+
+    def __init__(self, writer=None, batch_size=MAX_BATCH_WRITES, flush_interval=1.0,
+                 max_pending=50_000, backoff_base=0.5, backoff_max=30.0,
+                 max_attempts=MAX_ATTEMPTS):
+        self.writer = writer or FirestoreWriter()
+        self.batch_size = min(batch_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_attempts = max_attempts
+
+        # (collection, doc_id) -> (data, first queued at, attempts, batches written at last failure)
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._batch_limit = self.batch_size
+        self._failures_in_row = 0
+        self._latencies = deque(maxlen=512)
+        self.dead_letters = deque(maxlen=DEAD_LETTER_SAMPLE)
+        self.stats = {"enqueued": 0, "coalesced": 0, "dropped": 0, "written": 0,
+                      "batches": 0, "failed_batches": 0, "dead_lettered": 0,
+                      "last_error": None}
+
+        self._thread = threading.Thread(target=self._run, name="firebase-sync", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, collection, doc_id, data):
+        """Queue a write of data into collection/doc_id (merged, or replaced for plans). Never blocks on I/O."""
+        key = (collection, str(doc_id))
+        data = {**_plain(data), "updated_at": time.time()}
+        with self._cond:
+            if self._closed:
+                return False
+            current = self._pending.get(key)
+            if current is not None:
+                self._pending[key] = (_combine(collection, current[0], data), *current[1:])
+                self.stats["coalesced"] += 1
+            elif len(self._pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                return False
+            else:
+                self._pending[key] = (data, time.time(), 0, self.stats["batches"])
+            self.stats["enqueued"] += 1
+            if len(self._pending) >= self._batch_limit and not self._failures_in_row:
+                self._cond.notify()
+        return True
+
+    def _take_batch(self):
+        batch = []
+        while self._pending and len(batch) < self._batch_limit:
+            key, entry = self._pending.popitem(last=False)
+            batch.append((key, *entry))
+        return batch
+
+    def _requeue(self, batch, front=True):
+        """Put failed writes back at the front (or the back); writes queued since then win."""
+        for key, data, queued_at, attempts, mark in (reversed(batch) if front else batch):
+            newer = self._pending.get(key)
+            if newer:
+                data = _combine(key[0], data, newer[0])
+            self._pending[key] = (data, queued_at, attempts, mark)
+            self._pending.move_to_end(key, last=not front)
+
+    def _retry_or_dead_letter(self, write, exc, error):
+        """A document failed on its own: retry it behind the queue, or give up on it."""
+        (collection, doc_id), data, queued_at, attempts, mark = write
+        permanent = isinstance(exc, PERMANENT_ERRORS)
+        written = self.stats["batches"]
+        if permanent or written > mark:
+            attempts += 1
+        if attempts < self.max_attempts and not permanent:
+            self._requeue([((collection, doc_id), data, queued_at, attempts, written)], front=False)
+            return
+        self.stats["dead_lettered"] += 1
+        self.dead_letters.append({"collection": collection, "doc_id": doc_id,
+                                  "attempts": attempts, "error": error})
+        print(f"⚠ Firestore write to {collection}/{doc_id} dead-lettered after "
+              f"{attempts} attempts: {error}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._failures_in_row:
+                    delay = min(self.backoff_max, self.backoff_base * 2 ** (self._failures_in_row - 1))
+                    self._cond.wait(delay * random.uniform(0.5, 1.0))
+                elif not self._closed and len(self._pending) < self._batch_limit:
+                    self._cond.wait(self.flush_interval)
+                batch = self._take_batch()
+                closed = self._closed
+            if batch:
+                self._flush(batch)
+            with self._cond:
+                if closed and not self._pending:
+                    return
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self.writer.commit([(c, d, data) for (c, d), data, *_ in batch])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            with self._cond:
+                report = error != self.stats["last_error"]
+                self.stats["failed_batches"] += 1
+                self.stats["last_error"] = error
+                if len(batch) > 1:
+                    # Bisect: the halves go out as separate batches, without backoff
+                    self._batch_limit = (len(batch) + 1) // 2
+                    self._requeue(batch)
+                else:
+                    self._retry_or_dead_letter(batch[0], e, error)
+                    if not isinstance(e, PERMANENT_ERRORS):
+                        self._failures_in_row += 1
+            if report:
+                traceback.print_exc()
+            return
+        self._latencies.append(time.perf_counter() - started)
+        with self._cond:
+            self._failures_in_row = 0
+            self._batch_limit = min(self.batch_size, self._batch_limit * 2)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+
+    def metrics(self):
+        with self._cond:
+            depth = len(self._pending)
+            oldest = min(entry[1] for entry in self._pending.values()) if depth else None
+            stats = dict(self.stats)
+            failing = self._failures_in_row
+            batch_limit = self._batch_limit
+            dead_letters = list(self.dead_letters)
+        latencies = np.array(self._latencies) * 1000
+        return {
+            **stats,
+            "queue_depth": depth,
+            "oldest_pending_s": round(time.time() - oldest, 3) if oldest else 0.0,
+            "consecutive_failures": failing,
+            "batch_limit": batch_limit,
+            "dead_letters": dead_letters,
+            "flush_latency_ms": {
+                "last": round(float(latencies[-1]), 2),
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+                "max": round(float(latencies.max()), 2)
+            } if len(latencies) else None
+        }
+
+    def close(self, timeout=10.0):
+        """Stop accepting writes and wait up to timeout for the queue to drain."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+
+def _plain(value):
+    """numpy scalars / tuples -> types the Firestore client accepts."""
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def sync_from_env():
+    """FirebaseSync when FIREBASE_SYNC=1 (or an emulator is configured), otherwise None."""
+    enabled = os.environ.get("FIREBASE_SYNC", "")
+    if enabled == "0" or not (enabled or os.environ.get("FIRESTORE_EMULATOR_HOST")):
+        return None
+    try:
+        import google.cloud.firestore  # noqa: F401
+    except ImportError:
+        print("⚠ FIREBASE_SYNC is set but google-cloud-firestore is not installed; sync disabled")
+        return None
+    return FirebaseSync(flush_interval=float(os.environ.get("FIREBASE_FLUSH_SECONDS", 1.0)))
+
+
+# ---------------- Smoke test ----------------
+def main():
+    parser = argparse.ArgumentParser(
+        description="Push synthetic profile updates through the sync queue. "
+                    "Start the emulator first: firebase emulators:start --only firestore, "
+                    "then export FIRESTORE_EMULATOR_HOST=localhost:8080")
+    parser.add_argument("--writer", choices=["firestore", "memory"], default="firestore")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="memory writer only")
+    parser.add_argument("--bad-docs", type=int, default=0,
+                        help="updates to doc ids Firestore rejects, to exercise dead-lettering")
+    args = parser.parse_args()
+
+    writer = FirestoreWriter() if args.writer == "firestore" else MemoryWriter(args.failure_rate, 0.01)
+    sync = FirebaseSync(writer, flush_interval=0.2, backoff_base=0.05)
+    rng = random.Random(0)
+    started = time.perf_counter()
+    for i in range(args.updates):
+        sync.enqueue(PROFILES_COLLECTION, f"smoke-{rng.randrange(args.users)}",
+                     {"weight_kg": 60 + rng.random() * 30, "sequence": i})
+    for i in range(args.bad_docs):
+        sync.enqueue(PROFILES_COLLECTION, f"smoke/{i}", {"sequence": i})
+    enqueue_ms = (time.perf_counter() - started) * 1000
+    sync.close(timeout=60)
+
+    print(f"enqueue: {enqueue_ms:.1f} ms for {args.updates} updates")
+    print(sync.metrics())
+    if isinstance(writer, MemoryWriter):
+        print(f"{len(writer.docs)} documents in {writer.commits} commits")
+
+
+if __name__ == "__main__":
+    main()
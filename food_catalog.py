@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# ---------------------------------------------------------
+# 1. SCHEMA NORMALIZATION
+# ---------------------------------------------------------
+# Every known header spelling -> catalog column
+COLUMN_ALIASES = {
+    "food_name": "food_name",
+    "dish": "food_name",
+    "food name": "food_name",
+    "calories": "calories",
+    "calories (kcal)": "calories",
+    "fat_g": "fat_g",
+    "fat (g)": "fat_g",
+    "protein_g": "protein_g",
+    "protein (g)": "protein_g",
+    "carbs_g": "carbs_g",
+    "carbohydrates (g)": "carbs_g",
+}
+
+NUTRIENT_COLUMNS = ["calories", "protein_g", "carbs_g", "fat_g"]
+CATALOG_COLUMNS = ["food_name"] + NUTRIENT_COLUMNS + ["source", "is_complete"]
+
+# Earlier sources win when the same dish appears more than once
+DEFAULT_SOURCES = ["foods.csv", "food.csv", "food_image_merged.csv"]
+CATALOG_PATH = "data/food_catalog.csv"
+
+
+PORTION_NOTE = re.compile(r"\(\s*(\d+(?:\.\d+)?)\s*(g|gm|ml)\s*\)", re.I)
+
+
+def canonical_name(name):
+    """
+    Dedup key for a dish: lowercase, portion notes such as "(250 g)" removed,
+    whitespace collapsed.
+    """
+    name = str(name).lower()
+    name = PORTION_NOTE.sub(" ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def display_name(name):
+    name = PORTION_NOTE.sub(" ", str(name))
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def portion_grams(name):
+    """Portion size from a note such as "(250 g)" (ml counted as g), or None."""
+    match = PORTION_NOTE.search(str(name))
+    return float(match.group(1)) if match else None
+
+
+def normalize_chunk(chunk, source):
+    """Map one raw chunk onto the catalog schema."""
+    renamed = {}
+    for col in chunk.columns:
+        key = COLUMN_ALIASES.get(col.strip().lower())
+        if key is not None and key not in renamed.values():
+            renamed[col] = key
+    chunk = chunk.rename(columns=renamed)
+
+    missing = [c for c in ["food_name"] + NUTRIENT_COLUMNS if c not in chunk.columns]
+    if "food_name" in missing:
+        raise ValueError(f"No food name column in {source}")
+    for col in missing:
+        chunk[col] = np.nan
+
+    out = chunk[["food_name"] + NUTRIENT_COLUMNS].copy()
+    out = out[out["food_name"].notna()]
+    # Values given per portion ("chicken biryani (250 g)") -> per 100 g,
+    # which is what the planners assume once the note is dropped
+    portion = out["food_name"].map(portion_grams).astype(float)
+    scale = (100.0 / portion.where(portion > 0)).fillna(1.0)
+    out["food_name"] = out["food_name"].map(display_name)
+    out = out[out["food_name"] != ""]
+    for col in NUTRIENT_COLUMNS:
+        values = pd.to_numeric(out[col], errors="coerce") * scale[out.index]
+        out[col] = values.astype("float32")
+    out["source"] = os.path.basename(source)
+    out["is_complete"] = out[NUTRIENT_COLUMNS].notna().all(axis=1)
+    return out
+
+
+# ---------------------------------------------------------
+# 2. STREAMING MERGE
+# ---------------------------------------------------------
+def build_food_catalog(sources=None, output_path=CATALOG_PATH,
+                       keep_incomplete=False, chunksize=50_000):
+    """
+    Stream every source in chunks, normalize it, dedup by canonical name and
+    write the compiled catalog the planners load.
+
+    Only one row per distinct dish is held in memory, so catalog size (not
+    raw file size) bounds memory. A complete row always replaces an earlier
+    incomplete one; otherwise the first source wins. Incomplete rows are
+    dropped unless keep_incomplete=True, in which case they are kept with
+    is_complete=False.
+    """
+    sources = sources or DEFAULT_SOURCES
+    catalog = {}
+    report = {"sources": {}, "duplicates": 0, "incomplete_dropped": 0}
+
+    for source in sources:
+        rows_read = 0
+        for chunk in pd.read_csv(source, chunksize=chunksize):
+            chunk = normalize_chunk(chunk, source)
+            rows_read += len(chunk)
+            chunk["key"] = chunk["food_name"].map(canonical_name)
+            # Dedup inside the chunk first (complete rows, then file order)
+            unique = chunk.sort_values("is_complete", ascending=False, kind="stable")
+            unique = unique.drop_duplicates("key")
+            report["duplicates"] += len(chunk) - len(unique)
+            keys = unique.pop("key")
+            for key, row in zip(keys, unique.itertuples(index=False)):
+                current = catalog.get(key)
+                if current is None:
+                    catalog[key] = row
+                elif row.is_complete and not current.is_complete:
+                    catalog[key] = row
+                else:
+                    report["duplicates"] += 1
+        report["sources"][os.path.basename(source)] = rows_read
+
+    df = pd.DataFrame(list(catalog.values()), columns=CATALOG_COLUMNS)
+    if not keep_incomplete:
+        report["incomplete_dropped"] = int((~df["is_complete"]).sum())
+        df = df[df["is_complete"]]
+    df = df.sort_values("food_name", key=lambda s: s.str.lower()).reset_index(drop=True)
+    report["foods"] = len(df)
+
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        if output_path.endswith(".parquet"):
+            df.to_parquet(output_path, index=False)
+        else:
+            df.to_csv(output_path, index=False, float_format="%.6g")
+        with open(os.path.splitext(output_path)[0] + ".report.json", "w") as f:
+            json.dump(report, f, indent=2)
+
+    return df, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the food catalog")
+    parser.add_argument("sources", nargs="*", default=DEFAULT_SOURCES)
+    parser.add_argument("--output", default=CATALOG_PATH)
+    parser.add_argument("--keep-incomplete", action="store_true")
+    parser.add_argument("--chunksize", type=int, default=50_000)
+    args = parser.parse_args()
+
+    _, report = build_food_catalog(args.sources, args.output,
+                                   args.keep_incomplete, args.chunksize)
+    print(json.dumps(report, indent=2))
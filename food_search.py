@@ -0,0 +1,137 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    return _NON_ALNUM.sub(" ", str(text).lower()).strip()
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit=2):
+    """
+    Levenshtein distance restricted to a diagonal band of width 2 * limit + 1;
+    anything beyond limit is reported as limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    inf = limit + 1
+    prev = {j: j for j in range(min(len(b), limit) + 1)}
+    for i in range(1, len(a) + 1):
+        cur = {}
+        for j in range(max(0, i - limit), min(len(b), i + limit) + 1):
+            if j == 0:
+                cur[j] = i
+                continue
+            cur[j] = min(prev.get(j, inf) + 1, cur.get(j - 1, inf) + 1,
+                         prev.get(j - 1, inf) + (a[i - 1] != b[j - 1]))
+        if min(cur.values()) > limit:
+            return inf
+        prev = cur
+    return min(prev.get(len(b), inf), inf)
+
+
+class FoodSearchIndex:
+    """
+    In-memory typo-tolerant search over catalog food names.
+
+    - trigram inverted index: trigram -> sorted int32 array of food ids
+    - sorted name and word lists for prefix matches (bisect)
+    - final ranking of a short candidate list by trigram overlap, prefix
+      match and banded edit distance
+
+    Built once per catalog version; a query touches only the posting lists
+    of its own trigrams, never the whole catalog.
+    """
+
+    def __init__(self, names, max_candidates=32, postings_budget=4096):
+        self.names = list(names)
+        self.max_candidates = max_candidates
+        self.postings_budget = postings_budget
+        self.normalized = [normalize(n) for n in self.names]
+
+        postings = {}
+        words = []
+        for i, name in enumerate(self.normalized):
+            for gram in trigrams(name):
+                postings.setdefault(gram, []).append(i)
+            for word in name.split():
+                words.append((word, i))
+        self.postings = {g: np.array(ids, dtype=np.int32) for g, ids in postings.items()}
+
+        self._sorted_names = sorted((n, i) for i, n in enumerate(self.normalized))
+        self._sorted_words = sorted(words)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix_ids(self, items, prefix, cap):
+        ids = []
+        pos = bisect_left(items, (prefix, -1))
+        while pos < len(items) and len(ids) < cap and items[pos][0].startswith(prefix):
+            ids.append(items[pos][1])
+            pos += 1
+        return ids
+
+    def _overlap(self, q_grams):
+        """
+        Share of the query's trigrams each food contains, counted over the
+        rarest posting lists only (postings_budget ids in total): rare
+        trigrams carry the signal, very common ones would only cost time.
+        """
+        lists = sorted((self.postings[g] for g in q_grams if g in self.postings), key=len)
+        if not lists:
+            return np.empty(0, dtype=np.int32), np.empty(0)
+        used, total = [], 0
+        for ids in lists:
+            if used and total + len(ids) > self.postings_budget:
+                break
+            used.append(ids)
+            total += len(ids)
+
+        ids = np.sort(np.concatenate(used))
+        first = np.empty(len(ids), dtype=bool)
+        first[0] = True
+        np.not_equal(ids[1:], ids[:-1], out=first[1:])
+        starts = np.flatnonzero(first)
+        counts = np.diff(np.append(starts, len(ids)))
+        return ids[starts], counts / len(used)
+
+    def search(self, query, k=10):
+        """Top-k [(food id, score)], best first."""
+        q = normalize(query)
+        if not q:
+            return []
+
+        scores = {}
+        ids, share = self._overlap(trigrams(q))
+        if len(ids) > self.max_candidates:
+            top = np.argpartition(-share, self.max_candidates - 1)[:self.max_candidates]
+            ids, share = ids[top], share[top]
+        scores.update(zip(ids.tolist(), share.tolist()))
+
+        name_prefix = set(self._prefix_ids(self._sorted_names, q, k))
+        for i in name_prefix:
+            scores[i] = scores.get(i, 0.0) + 1.0
+        for i in self._prefix_ids(self._sorted_words, q.split()[-1], self.max_candidates):
+            if i not in name_prefix:
+                scores[i] = scores.get(i, 0.0) + 0.5
+
+        # Typo penalty only for the few candidates that can still make top-k
+        shortlist = sorted(scores.items(), key=lambda s: (-s[1], len(self.normalized[s[0]])))
+        ranked = []
+        for i, score in shortlist[:k + 8]:
+            if i not in name_prefix:
+                score -= 0.15 * edit_distance(q, self.normalized[i][:len(q)])
+            if score > 0:
+                ranked.append((score, -len(self.normalized[i]), i))
+
+        ranked.sort(reverse=True)
+        return [(i, round(score, 4)) for score, _, i in ranked[:k]]
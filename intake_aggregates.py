@@ -0,0 +1,273 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+from workout_events import EVENTS_DB_PATH, SCHEMA as WORKOUT_SCHEMA
+
+METRICS = ["calories", "protein_g", "carbs_g", "fat_g", "exercise_minutes", "exercise_sessions"]
+TARGET_METRICS = ["calories", "protein_g", "carbs_g", "fat_g"]
+WINDOWS = (7, 30)
+HISTORY_DAYS = max(WINDOWS)
+
+# Meals and plan targets live next to the workout events, so the windows
+# can be rebuilt from one database after a restart or on another worker
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intake_events (
+    id         INTEGER PRIMARY KEY,
+    user_id    TEXT NOT NULL,
+    day        INTEGER NOT NULL,
+    calories   REAL NOT NULL,
+    protein_g  REAL NOT NULL,
+    carbs_g    REAL NOT NULL,
+    fat_g      REAL NOT NULL,
+    logged_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_intake_events_user_day
+    ON intake_events (user_id, day);
+CREATE TABLE IF NOT EXISTS intake_targets (
+    user_id    TEXT PRIMARY KEY,
+    calories   REAL NOT NULL,
+    protein_g  REAL NOT NULL,
+    carbs_g    REAL NOT NULL,
+    fat_g      REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+INSERT_MEAL_SQL = """
+INSERT INTO intake_events (user_id, day, calories, protein_g, carbs_g, fat_g, logged_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+UPSERT_TARGETS_SQL = """
+INSERT INTO intake_targets (user_id, calories, protein_g, carbs_g, fat_g, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id) DO UPDATE SET
+    calories = excluded.calories, protein_g = excluded.protein_g,
+    carbs_g = excluded.carbs_g, fat_g = excluded.fat_g, updated_at = excluded.updated_at
+"""
+
+TARGETS_SQL = "SELECT calories, protein_g, carbs_g, fat_g FROM intake_targets WHERE user_id = ?"
+MEALS_SQL = "SELECT day, calories, protein_g, carbs_g, fat_g FROM intake_events WHERE user_id = ? AND day >= ?"
+WORKOUTS_SQL = "SELECT event_id, completed_at, duration FROM workout_events WHERE user_id = ? AND completed_at >= ?"
+FIRST_MEAL_SQL = "SELECT MIN(day) FROM intake_events WHERE user_id = ?"
+FIRST_WORKOUT_SQL = "SELECT MIN(completed_at) FROM workout_events WHERE user_id = ?"
+
+
+def day_number(value=None):
+    """date / datetime / ISO string / epoch seconds -> proleptic ordinal day; ValueError if malformed."""
+    if value is None:
+        return date.today().toordinal()
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).date().toordinal()
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        value = value.date()
+    if not isinstance(value, date):
+        raise ValueError(f"Invalid date: {value!r}")
+    return value.toordinal()
+
+
+def _day_start(day):
+    """Epoch seconds at 00:00 UTC of an ordinal day (workouts are bucketed in UTC)."""
+    return datetime.combine(date.fromordinal(day), datetime.min.time(), timezone.utc).timestamp()
+
+
+class UserWindow:
+    """
+    Daily totals for the last HISTORY_DAYS days in a fixed ring buffer.
+    Moving to a new day retires at most HISTORY_DAYS slots, so every update
+    is O(1) in history length. Queries (view) never move the window.
+    """
+
+    __slots__ = ("days", "last_day", "first_day", "workout_ids")
+
+    def __init__(self, today):
+        self.days = np.zeros((HISTORY_DAYS, len(METRICS)))
+        self.last_day = today
+        self.first_day = today
+        self.workout_ids = {}   # event_id -> day, for events already counted
+
+    def advance(self, today):
+        if today <= self.last_day:
+            return
+        if today - self.last_day >= HISTORY_DAYS:
+            self.days[:] = 0
+        else:
+            for d in range(self.last_day + 1, today + 1):
+                self.days[d % HISTORY_DAYS] = 0
+        self.last_day = today
+        oldest = today - HISTORY_DAYS
+        self.workout_ids = {e: d for e, d in self.workout_ids.items() if d > oldest}
+
+    def add(self, day, values):
+        """Add to one day's totals; returns False for days older than the history."""
+        self.advance(day)
+        if self.last_day - day >= HISTORY_DAYS:
+            return False
+        self.days[day % HISTORY_DAYS] += values
+        self.first_day = min(self.first_day, day)
+        return True
+
+    def add_workout(self, event_id, day, duration):
+        """Count a workout event once, however many times it is reported."""
+        if event_id in self.workout_ids:
+            return True
+        values = np.zeros(len(METRICS))
+        values[METRICS.index("exercise_minutes")] = duration or 0
+        values[METRICS.index("exercise_sessions")] = 1
+        if not self.add(day, values):
+            return False
+        self.workout_ids[event_id] = day
+        return True
+
+    def view(self, today):
+        """Daily totals for the HISTORY_DAYS days ending at today, oldest first."""
+        days = np.arange(today - HISTORY_DAYS + 1, today + 1)
+        known = (days > self.last_day - HISTORY_DAYS) & (days <= self.last_day)
+        series = np.zeros((HISTORY_DAYS, len(METRICS)))
+        series[known] = self.days[days[known] % HISTORY_DAYS]
+        return series
+
+
+class IntakeAggregator:
+    """
+    Per-user rolling 7/30-day intake and exercise totals, compared with the
+    targets of the user's latest meal plan.
+
+    Meals and targets are stored in SQLite next to the workout events; the
+    windows in memory are a cache, loaded from the database on a user's
+    first query. Writes update only windows already loaded, under the same
+    lock as loading, so nothing is counted twice. Workouts are matched by
+    event_id, since their listener runs after the workout commit.
+    """
+
+    def __init__(self, path=EVENTS_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(WORKOUT_SCHEMA + SCHEMA)
+        self._users = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _load(self, user_id):
+        """Window rebuilt from the database, or None when the user has no data (lock held)."""
+        first_meal = self._db.execute(FIRST_MEAL_SQL, (user_id,)).fetchone()[0]
+        first_workout = self._db.execute(FIRST_WORKOUT_SQL, (user_id,)).fetchone()[0]
+        firsts = [first_meal] if first_meal is not None else []
+        if first_workout is not None:
+            firsts.append(day_number(first_workout))
+        if not firsts:
+            return None
+
+        today = day_number()
+        oldest = today - HISTORY_DAYS + 1
+        window = UserWindow(today)
+        for day, *values in self._db.execute(MEALS_SQL, (user_id, oldest)):
+            window.add(day, np.array(values + [0.0, 0.0]))
+        for event_id, completed_at, duration in self._db.execute(WORKOUTS_SQL, (user_id, _day_start(oldest))):
+            window.add_workout(event_id, day_number(completed_at), duration)
+        window.first_day = min(firsts)
+        self._users[user_id] = window
+        return window
+
+    def _window(self, user_id):
+        window = self._users.get(user_id)
+        return window if window is not None else self._load(user_id)
+
+    def record_meal(self, user_id, when=None, **nutrients):
+        user_id = str(user_id)
+        day = day_number(when)
+        vector = np.array([float(nutrients.get(m) or 0) for m in TARGET_METRICS])
+        if (vector < 0).any():
+            raise ValueError("Intake values cannot be negative")
+        with self._lock:
+            with self._db:
+                self._db.execute(INSERT_MEAL_SQL, (user_id, day, *vector.tolist(), time.time()))
+            window = self._users.get(user_id)
+            if window is not None and not window.add(day, np.concatenate([vector, [0.0, 0.0]])):
+                self.dropped += 1
+
+    def record_workouts(self, events):
+        """Newly stored workout events, fed by WorkoutEventStore.on_commit."""
+        with self._lock:
+            for e in events:
+                # Not loaded yet: the first query reads it from the database
+                window = self._users.get(str(e["user_id"]))
+                if window is not None and not window.add_workout(
+                        e["event_id"], day_number(e["completed_at"]), e.get("duration")):
+                    self.dropped += 1
+
+    def set_targets(self, user_id, day_plan):
+        """Daily targets from one day of generate_meal_plan output."""
+        macros = day_plan["daily_macro_targets"]
+        row = (str(user_id), float(day_plan["predicted_daily_calories"]), float(macros["protein_g"]),
+               float(macros["carbs_g"]), float(macros["fat_g"]), time.time())
+        with self._lock, self._db:
+            self._db.execute(UPSERT_TARGETS_SQL, row)
+
+    # -------- cache management (dispatcher.py) --------
+    def users(self):
+        """Users whose window is loaded in this process."""
+        with self._lock:
+            return sorted(self._users)
+
+    def evict(self, user_ids):
+        """Drop loaded windows; they are rebuilt from the database when next queried."""
+        with self._lock:
+            return sum(self._users.pop(str(u), None) is not None for u in user_ids)
+
+    # -------- queries --------
+    def adherence(self, user_id, today=None):
+        today = day_number(today)
+        user_id = str(user_id)
+        with self._lock:
+            window = self._window(user_id)
+            if window is None:
+                return None
+            series = window.view(today)
+            tracked_days = today - window.first_day + 1
+            row = self._db.execute(TARGETS_SQL, (user_id,)).fetchone()
+        targets = np.array(row, dtype=float) if row else None
+
+        out = {"user_id": user_id, "windows": {}}
+        for w in WINDOWS:
+            total = series[-w:].sum(axis=0)
+            days = max(1, min(w, tracked_days))
+            avg = total / days
+            entry = {
+                "days": days,
+                "totals": {m: round(float(v), 1) for m, v in zip(METRICS, total)},
+                "daily_average": {m: round(float(v), 1) for m, v in zip(METRICS, avg)}
+            }
+            if targets is not None:
+                entry["adherence"] = {
+                    m: round(float(avg[i] / targets[i]), 3) if targets[i] else None
+                    for i, m in enumerate(TARGET_METRICS)
+                }
+            out["windows"][f"{w}d"] = entry
+        if targets is not None:
+            out["targets"] = {m: float(t) for m, t in zip(TARGET_METRICS, targets)}
+        return out
+
+    def trends(self, user_id, today=None):
+        today = day_number(today)
+        with self._lock:
+            window = self._window(str(user_id))
+            if window is None:
+                return None
+            series = window.view(today)
+
+        first = today - HISTORY_DAYS + 1
+        return {
+            "user_id": str(user_id),
+            "days": [date.fromordinal(first + i).isoformat() for i in range(HISTORY_DAYS)],
+            "series": {m: [round(float(v), 1) for v in series[:, i]] for i, m in enumerate(METRICS)}
+        }
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import aiohttp
+except ImportError:  # only needed to run the harness
+    aiohttp = None
+
+try:
+    import psutil
+except ImportError:  # /proc fallback below (Linux)
+    psutil = None
+
+ACTIVITY_LABELS = {
+    "sedentary": "sedentary",
+    "light": "lightly active",
+    "moderate": "moderately active",
+    "active": "very active"
+}
+DEFAULT_MIX = "profile_setup=1,meal_plan=3,exercise_plan=2"
+DEFAULT_STEPS = "1,2,4,8,16,32"
+
+
+# ---------------- Payloads ----------------
+def load_payloads(path="pakistan_user_profiles.csv", seed=0):
+    """Request bodies per endpoint built from the sample user profiles."""
+    rng = random.Random(seed)
+    df = pd.read_csv(path)
+    payloads = {"profile_setup": [], "meal_plan": [], "exercise_plan": []}
+
+    for r in df.itertuples(index=False):
+        goal = r.target_goal.lower()
+        activity = ACTIVITY_LABELS.get(str(r.activity_level).lower(), "sedentary")
+        conditions = [] if pd.isna(r.health_condition) else [r.health_condition]
+        target_weight = r.weight_kg + {"weight loss": -5, "weight gain": 5}.get(goal, 1)
+
+        payloads["profile_setup"].append({
+            "user_id": f"load-{r.name}-{r.age}-{r.weight_kg}",
+            "age": int(r.age),
+            "weight": float(r.weight_kg),
+            "targetWeight": float(target_weight),
+            "height": round(r.height_cm / 30.48, 2),
+            "gender": r.gender.lower(),
+            "activitylevel": activity,
+            "goal": goal,
+            "health_conditions": conditions
+        })
+        payloads["meal_plan"].append({
+            "age": int(r.age),
+            "weight_kg": float(r.weight_kg),
+            "height_cm": float(r.height_cm),
+            "gender": r.gender,
+            "activity_level": r.activity_level,
+            "target_goal": goal,
+            "health_conditions": conditions
+        })
+        payloads["exercise_plan"].append({
+            "goal": goal,
+            "activitylevel": activity,
+            "timeline_weeks": rng.randint(2, 16)
+        })
+    return payloads
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+# ---------------- Server process stats ----------------
+def _proc_tree(pid):
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            return [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+    pids = [pid]
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid in pids:
+                pids.append(int(entry))
+    return pids
+
+
+def sample_processes(pid):
+    """{pid: (cpu_seconds, rss_mb)} for the server and its worker processes."""
+    out = {}
+    for proc in _proc_tree(pid):
+        try:
+            if psutil is not None:
+                t = proc.cpu_times()
+                out[proc.pid] = (t.user + t.system, proc.memory_info().rss / 2**20)
+            else:
+                with open(f"/proc/{proc}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                ticks = os.sysconf("SC_CLK_TCK")
+                cpu = (int(fields[11]) + int(fields[12])) / ticks
+                rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+                out[proc] = (cpu, rss)
+        except Exception:
+            continue
+    return out
+
+
+# ---------------- Load generation ----------------
+async def _worker(session, base_url, mix, payloads, deadline, results, rng):
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(names, weights)[0]
+        body = rng.choice(payloads[endpoint])
+        started = time.perf_counter()
+        try:
+            async with session.post(f"{base_url}/{endpoint}", json=body) as resp:
+                await resp.read()
+                ok = resp.status < 400
+        except Exception:
+            ok = False
+        results.append((endpoint, time.perf_counter() - started, ok))
+
+
+def summarize(results, elapsed):
+    def stats(rows):
+        lat = np.array([r[1] for r in rows]) * 1000
+        errors = sum(1 for r in rows if not r[2])
+        if len(lat) == 0:
+            return {"requests": 0}
+        return {
+            "requests": len(rows),
+            "rps": round(len(rows) / elapsed, 2),
+            "error_rate": round(errors / len(rows), 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 2),
+            "p95_ms": round(float(np.percentile(lat, 95)), 2),
+            "p99_ms": round(float(np.percentile(lat, 99)), 2)
+        }
+
+    out = stats(results)
+    out["endpoints"] = {e: stats([r for r in results if r[0] == e])
+                        for e in sorted({r[0] for r in results})}
+    return out
+
+
+async def run_step(base_url, concurrency, duration, mix, payloads, server_pid=None, seed=0):
+    results = []
+    before = sample_processes(server_pid) if server_pid else {}
+    started = time.perf_counter()
+    deadline = started + duration
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(
+            _worker(session, base_url, mix, payloads, deadline, results, random.Random(seed + i))
+            for i in range(concurrency)
+        ))
+
+    elapsed = time.perf_counter() - started
+    step = {"concurrency": concurrency, "duration_s": round(elapsed, 2), **summarize(results, elapsed)}
+
+    if server_pid:
+        after = sample_processes(server_pid)
+        step["workers"] = [
+            {
+                "pid": pid,
+                "cpu_percent": round(100 * (cpu - before.get(pid, (0, 0))[0]) / elapsed, 1),
+                "rss_mb": round(rss, 1)
+            }
+            for pid, (cpu, rss) in sorted(after.items())
+        ]
+    return step
+
+
+# ---------------- Local server ----------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def isolated_env(root):
+    """Stores under root instead of data/, so load runs never touch live profiles or archives."""
+    return {
+        "PROFILES_DB": os.path.join(root, "profiles.db"),
+        "WORKOUT_EVENTS_DB": os.path.join(root, "workout_events.db"),
+        "PLAN_ARCHIVE_DIR": os.path.join(root, "plan_archive")
+    }
+
+
+def start_server(command=None, port=None, timeout=120, env=None):
+    """
+    Start the app locally (default: Flask threaded server) and wait until it
+    accepts connections. env entries are added to the server's environment.
+    """
+    port = port or _free_port()
+    command = command or (
+        f"{sys.executable} -c \"from main import app; "
+        f"app.run(host='127.0.0.1', port={port}, threaded=True)\""
+    )
+    proc = subprocess.Popen(command.format(port=port), shell=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Server did not start in time")
+
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, 15)
+        proc.wait(10)
+    except Exception:
+        proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step-load the NutriFit API and record saturation curves")
+    parser.add_argument("--url", help="existing server (default: start main.py locally)")
+    parser.add_argument("--server-cmd", help="command to start the server; {port} is substituted, "
+                                             "e.g. 'gunicorn -w 4 -b 127.0.0.1:{port} main:app'")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--steps", default=DEFAULT_STEPS, help="concurrency levels")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per step")
+    parser.add_argument("--profiles", default="pakistan_user_profiles.csv")
+    parser.add_argument("--label", default="default")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--plan-cache-entries", type=int, default=None,
+                        help="plan cache size of the started server; 0 disables it so "
+                             "repeated payloads measure plan generation, not cache hits")
+    parser.add_argument("--live-data", action="store_true",
+                        help="let the started server use data/ instead of a temporary directory")
+    args = parser.parse_args()
+
+    if aiohttp is None:
+        raise SystemExit("loadtest.py needs aiohttp: pip install aiohttp")
+
+    mix = parse_mix(args.mix)
+    payloads = load_payloads(args.profiles)
+
+    scratch = None
+    if args.url:
+        proc, url = None, args.url
+    else:
+        env = {}
+        if not args.live_data:
+            scratch = tempfile.TemporaryDirectory(prefix="nutrifit_load_")
+            env = isolated_env(scratch.name)
+        if args.plan_cache_entries is not None:
+            env["PLAN_CACHE_ENTRIES"] = str(args.plan_cache_entries)
+        proc, url = start_server(args.server_cmd, env=env)
+    report = {"label": args.label, "url": url, "mix": mix, "server_cmd": args.server_cmd,
+              "plan_cache_entries": args.plan_cache_entries,
+              "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "steps": []}
+    try:
+        for concurrency in [int(c) for c in args.steps.split(",")]:
+            step = asyncio.run(run_step(url, concurrency, args.duration, mix, payloads,
+                                        server_pid=proc.pid if proc else None))
+            report["steps"].append(step)
+            print(f"c={concurrency:<4} rps={step.get('rps', 0):<8} p50={step.get('p50_ms')}ms "
+                  f"p99={step.get('p99_ms')}ms errors={step.get('error_rate')}")
+    finally:
+        if proc is not None:
+            stop_server(proc)
+        if scratch is not None:
+            scratch.cleanup()
+
+    output = args.output or os.path.join("reports", f"loadtest_{args.label}_{int(time.time())}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
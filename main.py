@@ -2,31 +2,72 @@ import os
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 
-from exercise_plan import map_activity_level, generate_exercise_plan
+from exercise_plan import map_activity_level, generate_exercise_plan, find_substitutes
 
 from profile_setup import profile_setup
 
-from meal_plan import (
-    load_food_data,
-    load_calorie_model,
-    train_calorie_model,
-    generate_meal_plan
-)
+from profile_store import ProfileStore, ProfileNotFound, PROFILES_DB_PATH, meal_profile, exercise_profile
+
+from exercise_video import handle_exercise_video
+from workout_events import WorkoutEventStore, EVENTS_DB_PATH
+from intake_aggregates import IntakeAggregator
+from plan_archive import open_archive, flush_on_sigterm, ARCHIVE_DIR
+from firebase_sync import sync_from_env, MEAL_PLANS_COLLECTION, EXERCISE_PLANS_COLLECTION
+
+from food_catalog import CATALOG_PATH
+from catalog_manager import CatalogManager
+from plan_cache import PlanCache
+
+from meal_plan import generate_meal_plan
+from model_registry import load_serving_model
 
 app = Flask(__name__)
 CORS(app)
 
-food_data = load_food_data("foods.csv")
+catalogs = CatalogManager(
+    # The compiled catalog is picked up as soon as it exists; until then
+    # foods.csv is normalized on load the same way
+    food_path=[CATALOG_PATH, "foods.csv"],
+    exercise_path="excercise.csv",
+    poll_interval=float(os.environ.get("CATALOG_POLL_SECONDS", 5))
+).start()
+
+profiles = ProfileStore(os.environ.get("PROFILES_DB", PROFILES_DB_PATH))
+
+workout_events = WorkoutEventStore(os.environ.get("WORKOUT_EVENTS_DB", EVENTS_DB_PATH))
+
+# Meals and targets are stored in the same database as the workout events
+intake = IntakeAggregator(workout_events.path)
+# Only events a commit actually stored count toward adherence
+workout_events.on_commit(intake.record_workouts)
 
-if os.path.exists("models/calorie_model.pkl"):
-    calorie_model = load_calorie_model()
-else:
-    calorie_model = train_calorie_model()
+# One writer per directory: extra worker processes get their own shard
+plan_archive = open_archive(os.environ.get("PLAN_ARCHIVE_DIR", ARCHIVE_DIR))
+# SIGTERM becomes a normal exit, so the atexit hooks run too: buffered
+# workout events (already acknowledged with 202) are committed first
+flush_on_sigterm(plan_archive)
+
+# Write-behind copy of profiles and plans in Firestore (FIREBASE_SYNC=1,
+# or FIRESTORE_EMULATOR_HOST for the local emulator). None when disabled.
+firebase_sync = sync_from_env()
+
+plan_cache = PlanCache(max_entries=int(os.environ.get("PLAN_CACHE_ENTRIES", 10_000)))
+catalogs.on_swap(lambda snapshot: plan_cache.invalidate(snapshot.version))
+
+# Never trains here: run `python model_registry.py train` to publish a version.
+# Without any trained model the TDEE fallback serves predictions.
+calorie_model = load_serving_model(
+    version=os.environ.get("CALORIE_MODEL_VERSION") or None,
+    canary=os.environ.get("CALORIE_MODEL_CANARY") or None,
+    canary_fraction=float(os.environ.get("CALORIE_MODEL_CANARY_FRACTION", 0)),
+    shadows=os.environ.get("CALORIE_MODEL_SHADOWS", "").split(","),
+    use_surface=os.environ.get("CALORIE_INFERENCE") == "surface"
+)
 
 @app.route("/profile_setup", methods=["POST"])
 def handle_profile_setup_endpoint():
     try:
-        return profile_setup()
+        return profile_setup(profiles, sync=firebase_sync)
     except Exception as e:
         app.logger.error(f"Error in profile setup: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -35,25 +76,207 @@ def handle_profile_setup_endpoint():
 def meal_plan_endpoint():
     try:
         user_data = request.json
+        user_id = user_data.get("user_id")
+        if user_id and "age" not in user_data:
+            user_data = meal_profile(profiles.get(user_data["user_id"]), overrides=user_data)
+        catalog = catalogs.current()
+
+        key = PlanCache.make_key("meal", catalog.version, user_data)
+        result = plan_cache.get(key)
+        if result is None:
+            result = generate_meal_plan(
+                user_profile=user_data,
+                model=calorie_model,
+                food_df=catalog.foods,
+                mode=user_data.get("mode", "greedy"),
+                allergen_index=catalog.allergens
+            )
+            plan_cache.put(key, result)
 
-        result = generate_meal_plan(
-            user_profile=user_data,
-            model=calorie_model,
-            food_df=food_data
-        )
+        if user_id and "day_1" in result:
+            intake.set_targets(user_id, result["day_1"])
+            plan_archive.append(user_id, result)
+            if firebase_sync is not None:
+                firebase_sync.enqueue(MEAL_PLANS_COLLECTION, user_id, result)
 
         return jsonify(result)
 
 
+    except ProfileNotFound as e:
+        return jsonify({"status": "error", "message": e.args[0]}), 404
+
     except Exception as e:
 
         app.logger.error("Meal plan ERROR:", exc_info=True)
 
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/profiles/<user_id>", methods=["GET"])
+def get_profile_endpoint(user_id):
+    try:
+        return jsonify({"status": "success", "profile": profiles.get(user_id)})
+    except ProfileNotFound as e:
+        return jsonify({"status": "error", "message": e.args[0]}), 404
+
+@app.route("/profiles/cohorts", methods=["GET"])
+def profile_cohorts_endpoint():
+    return jsonify({"status": "success", "cohorts": profiles.cohort_summary()})
+
+@app.route("/intake_log", methods=["POST"])
+def intake_log_endpoint():
+    try:
+        data = request.get_json()
+        if not data or not data.get("user_id"):
+            return jsonify({"status": "error", "message": "Missing required field: user_id"}), 400
+
+        items = data.get("items", [data])
+        for item in items:
+            intake.record_meal(
+                data["user_id"], item.get("eaten_at", data.get("eaten_at")),
+                calories=item.get("calories"), protein_g=item.get("protein_g"),
+                carbs_g=item.get("carbs_g"), fat_g=item.get("fat_g")
+            )
+        return jsonify({"status": "success", "message": f"Logged {len(items)} items"})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+@app.route("/adherence/<user_id>", methods=["GET"])
+def adherence_endpoint(user_id):
+    try:
+        result = intake.adherence(user_id, request.args.get("date"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid date: {e}"}), 400
+    if result is None:
+        return jsonify({"status": "error", "message": f"No intake logged for user_id '{user_id}'"}), 404
+    return jsonify({"status": "success", **result})
+
+@app.route("/trends/<user_id>", methods=["GET"])
+def trends_endpoint(user_id):
+    try:
+        result = intake.trends(user_id, request.args.get("date"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid date: {e}"}), 400
+    if result is None:
+        return jsonify({"status": "error", "message": f"No intake logged for user_id '{user_id}'"}), 404
+    return jsonify({"status": "success", **result})
+
+# Used by dispatcher.py to drop cached aggregates of users whose worker changed
+@app.route("/intake_state", methods=["GET"])
+def intake_state_endpoint():
+    return jsonify({"user_ids": intake.users()})
+
+@app.route("/intake_state/evict", methods=["POST"])
+def intake_state_evict_endpoint():
+    data = request.get_json(silent=True) or {}
+    return jsonify({"status": "success", "evicted": intake.evict(data.get("user_ids") or [])})
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats_endpoint():
+    return jsonify({"pid": os.getpid(), "plan_cache": plan_cache.stats()})
+
+@app.route("/sync_metrics", methods=["GET"])
+def sync_metrics_endpoint():
+    if firebase_sync is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **firebase_sync.metrics()})
+
+@app.route("/calorie_model", methods=["GET"])
+def calorie_model_endpoint():
+    return jsonify(calorie_model.stats())
+
+def int_arg(name, default, maximum):
+    """Positive integer query parameter capped at maximum; ValueError if malformed."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < 1:
+        raise ValueError(f"{name} must be at least 1")
+    return min(value, maximum)
+
+@app.route("/catalog_status", methods=["GET"])
+def catalog_status_endpoint():
+    catalog = catalogs.current()
+    return jsonify({
+        "version": catalog.version,
+        "food_path": catalog.food_path,
+        "foods": len(catalog.foods),
+        "allergen_coverage": catalog.allergens.coverage()
+    })
+
+@app.route("/food_search", methods=["GET"])
+def food_search_endpoint():
+    query = request.args.get("q", "")
+    try:
+        k = int_arg("k", 10, 50)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    catalog = catalogs.current()
+
+    foods = catalog.foods
+    results = []
+    for i, score in catalog.food_search.search(query, k):
+        row = foods.iloc[i]
+        results.append({
+            "food_name": row["food_name"],
+            "score": score,
+            "calories": float(row["calories"]),
+            "protein_g": float(row["protein_g"]),
+            "carbs_g": float(row["carbs_g"]),
+            "fat_g": float(row["fat_g"])
+        })
+    return jsonify({"query": query, "catalog_version": catalog.version, "results": results})
+
+@app.route("/exercise_substitute", methods=["GET"])
+def exercise_substitute_endpoint():
+    exercise = request.args.get("exercise")
+    if not exercise:
+        return jsonify({"status": "error", "message": "Missing required parameter: exercise"}), 400
+
+    try:
+        k = int_arg("k", 5, 20)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    muscles = request.args.get("muscle_groups")
+    substitutes = find_substitutes(
+        exercise,
+        goal=request.args.get("goal"),
+        muscle_groups=muscles.split(",") if muscles else None,
+        k=k,
+        exercise_index=catalogs.current().exercises
+    )
+    if substitutes is None:
+        return jsonify({"status": "error", "message": f"Unknown exercise '{exercise}'"}), 404
+    return jsonify({"status": "success", "exercise": exercise, "substitutes": substitutes})
+
 @app.route("/exercise_video", methods=["POST"])
 def handle_exercise_video_endpoint():
-    return jsonify({"message": "Exercise video endpoint (not implemented)"}), 200
+    try:
+        return handle_exercise_video(workout_events)
+    except Exception as e:
+        app.logger.error(f"Error recording workout events: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route("/exercise_history/<user_id>", methods=["GET"])
+def exercise_history_endpoint(user_id):
+    try:
+        limit = int_arg("limit", 100, 1000)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        since = float(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"status": "error", "message": "since must be a number (epoch seconds)"}), 400
+    try:
+        events = workout_events.history(user_id, since=since, limit=limit)
+        return jsonify({"status": "success", "user_id": user_id, "events": events})
+    except Exception as e:
+        app.logger.error(f"Error reading exercise history: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/exercise_plan", methods=["POST"])
 def exercise_plan_endpoint():
@@ -63,26 +286,41 @@ def exercise_plan_endpoint():
         if not data:
             return jsonify({"status": "error", "message": "No user profile sent"}), 400
 
+        user_id = data.get("user_id")
+        if user_id and "goal" not in data:
+            data = exercise_profile(profiles.get(user_id), overrides=data)
+
         user_profile = {
             'target_goal': data.get("goal").lower(),
             'activity_level': data.get("activitylevel").lower(),
-            'timeline_weeks': int(data.get("timeline_weeks"))
+            'timeline_weeks': int(data.get("timeline_weeks")),
+            'muscles': data.get("muscles") or []
         }
 
         mapped_activity_level = map_activity_level(user_profile['activity_level'])
         user_profile['activity_level'] = mapped_activity_level
 
-        plan = generate_exercise_plan(user_profile)
+        catalog = catalogs.current()
+        key = PlanCache.make_key("exercise", catalog.version, user_profile)
+        plan = plan_cache.get(key)
+        if plan is None:
+            plan = generate_exercise_plan(user_profile, exercise_index=catalog.exercises)
+            plan_cache.put(key, plan)
 
         if not plan:
             return jsonify({"status": "error", "message": "Failed to generate exercise plan"}), 500
 
+        if firebase_sync is not None and user_id:
+            firebase_sync.enqueue(EXERCISE_PLANS_COLLECTION, user_id, {"plan": plan})
+
         return jsonify({
             "status": "success",
             "message": "Exercise plan generated successfully",
             "plan": plan
         })
 
+    except ProfileNotFound as e:
+        return jsonify({"status": "error", "message": e.args[0]}), 404
     except Exception as e:
         app.logger.error(f"Error generating exercise plan: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
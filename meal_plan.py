@@ -5,8 +5,13 @@ from sklearn.preprocessing import OneHotEncoder
 from xgboost import XGBRegressor
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
-from scipy.optimize import nnls
+from scipy.optimize import nnls, lsq_linear
 import os
+import time
+
+from model_registry import TDEEFallbackModel, normalize_features
+from food_catalog import normalize_chunk, canonical_name
+from allergen_index import AllergenIndex, user_allergies
 
 # ---------------------------------------------------------
 # 1. FOOD CATEGORIES
@@ -36,29 +41,66 @@ DINNER_FOODS = LUNCH_FOODS
 # 2. LOAD FOOD DATA
 # ---------------------------------------------------------
 def load_food_data(path="foods.csv"):
-    df = pd.read_csv(path)
+    """
+    Load a food table: the compiled catalog from food_catalog.py, or a raw
+    source such as foods.csv, which gets the same normalization on the fly
+    (per-100 g values, portion notes dropped, duplicates merged). Rows with
+    missing macros are dropped instead of being treated as zero-calorie foods.
+    """
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    if "is_complete" not in df.columns:
+        df = normalize_chunk(df, path)
+        df["key"] = df["food_name"].map(canonical_name)
+        df = (df.sort_values("is_complete", ascending=False, kind="stable")
+                .drop_duplicates("key").drop(columns="key").sort_index())
+        # float32 in the catalog builder; same precision as the written catalog
+        df[NUTRIENT_COLUMNS] = df[NUTRIENT_COLUMNS].astype(float).round(4)
     required = ["food_name", "calories", "protein_g", "carbs_g", "fat_g"]
     for r in required:
         if r not in df.columns:
             raise ValueError(f"Missing column in foods CSV: {r}")
 
-    df.fillna(0, inplace=True)
+    incomplete = df[required].isna().any(axis=1)
+    if "is_complete" in df.columns:
+        incomplete |= ~df["is_complete"].astype(bool)
+    if incomplete.any():
+        print(f"⚠ Skipping {int(incomplete.sum())} foods with missing nutrients in {path}")
+        df = df[~incomplete].reset_index(drop=True)
+
+    df["food_name"] = df["food_name"].str.strip()
     df["food_name_lower"] = df["food_name"].str.lower()
     return df
 
 # ---------------------------------------------------------
 # 3. TRAIN / LOAD CALORIE MODEL
 # ---------------------------------------------------------
-def train_calorie_model(csv_file="pakistan_user_profiles.csv",
-                        model_path="models/calorie_model.pkl"):
-    df = pd.read_csv(csv_file)
-
+def calorie_training_frame(df):
+    """
+    Features and target for the calorie model. Profile exports without a
+    logged "calories" column (pakistan_user_profiles.csv) get the TDEE-based
+    goal calories as target. Categories are mapped onto the training labels
+    (normalize_features), the same mapping the serving path applies.
+    """
+    df = df.copy()
     df["gender"] = df["gender"].fillna("Male")
     df["activity_level"] = df["activity_level"].fillna("Moderate")
     df["target_goal"] = df["target_goal"].fillna("maintain")
 
     X = df[["age", "weight_kg", "height_cm", "gender", "activity_level", "target_goal"]]
-    y = df["calories"]
+    if "calories" in df.columns:
+        y = df["calories"]
+    else:
+        y = TDEEFallbackModel().predict(X)
+    return normalize_features(X), y
+
+
+def train_calorie_model(csv_file="pakistan_user_profiles.csv",
+                        model_path="models/calorie_model.pkl"):
+    """Fit the calorie pipeline; saved to model_path unless it is None."""
+    X, y = calorie_training_frame(pd.read_csv(csv_file))
 
     preprocessor = ColumnTransformer(
         transformers=[
@@ -72,14 +114,17 @@ def train_calorie_model(csv_file="pakistan_user_profiles.csv",
         n_estimators=400,
         learning_rate=0.06,
         max_depth=4,
-        objective="reg:squarederror"
+        objective="reg:squarederror",
+        tree_method="hist",
+        n_jobs=-1
     )
 
     pipeline = Pipeline([("pre", preprocessor), ("model", model)])
     pipeline.fit(X, y)
 
-    os.makedirs("models", exist_ok=True)
-    joblib.dump(pipeline, model_path)
+    if model_path:
+        os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+        joblib.dump(pipeline, model_path)
     return pipeline
 
 def load_calorie_model(model_path="models/calorie_model.pkl"):
@@ -88,28 +133,35 @@ def load_calorie_model(model_path="models/calorie_model.pkl"):
 # ---------------------------------------------------------
 # 4. FOOD FILTERING BASED ON ALLERGIES / HEALTH
 # ---------------------------------------------------------
-def filter_foods(df, profile):
-    allergies = [a.lower() for a in profile.get("allergies", [])]
+def filter_foods(df, profile, allergen_index=None):
+    """
+    Drop foods the profile cannot eat. Allergies (including "Allergy: X"
+    health conditions) are resolved through the ingredient AllergenIndex;
+    pass the catalog's prebuilt index to avoid building one per call.
+    """
+    allergies = user_allergies(profile)
     health = [h.lower() for h in profile.get("health_conditions", [])]
 
-    out = df.copy()
+    # One mask, one selection: the catalog itself is never copied
+    keep = np.ones(len(df), dtype=bool)
     if len(allergies) > 0:
-        pattern = "|".join(allergies)
-        out = out[~out["food_name_lower"].str.contains(pattern, na=False)]
+        if allergen_index is None:
+            allergen_index = AllergenIndex(df)
+        keep &= ~df.index.isin(list(allergen_index.excluded(allergies)))
 
     if "diabetes" in health:
-        out = out[~out["food_name_lower"].str.contains(
+        keep &= ~df["food_name_lower"].str.contains(
             "halwa|kheer|mithai|dessert|juice|milkshake|soda|sweet|pancake|cereal",
             case=False, na=False
-        )]
+        ).to_numpy()
 
     if "hypertension" in health:
-        out = out[~out["food_name_lower"].str.contains(
+        keep &= ~df["food_name_lower"].str.contains(
             "fried|samosa|pakora|chips|paratha|biryani|nihari|haleem",
             case=False, na=False
-        )]
+        ).to_numpy()
 
-    return out.reset_index(drop=True)
+    return df[keep].reset_index(drop=True)
 
 # ---------------------------------------------------------
 # 5. COSINE SIMILARITY FOR FOOD SELECTION
@@ -160,35 +212,170 @@ MEAL_SPLITS = {
 }
 
 # ---------------------------------------------------------
-# 8. GENERATE WEEKLY MEAL PLAN
+# 8. CONSTRAINED MEAL OPTIMIZER
+# ---------------------------------------------------------
+NUTRIENT_COLUMNS = ["calories", "protein_g", "carbs_g", "fat_g"]
+PORTION_BOUNDS = (60, 350)
+ITEMS_PER_MEAL = 3
+MACRO_TOLERANCE = 0.10          # max relative miss per target (cal/pro/carb/fat)
+OPTIMIZER_TIME_BUDGET_MS = 150  # per request, across all days
+
+
+def _fit_portions_batch(A):
+    """
+    Bounded least squares for a batch of food sets at once.
+    A has shape (m, 4, k): per-gram nutrients divided by the meal target,
+    so the ideal solution satisfies A @ g == 1 for every target.
+    Returns grams (m, k) and the worst relative miss per set (m,).
+    """
+    lo, hi = PORTION_BOUNDS
+    At = np.transpose(A, (0, 2, 1))
+    gram = At @ A + 1e-9 * np.eye(A.shape[2])
+    rhs = At.sum(axis=2)
+    grams = np.clip(np.linalg.solve(gram, rhs[..., None])[..., 0], lo, hi)
+    miss = np.abs((A @ grams[..., None])[..., 0] - 1.0).max(axis=1)
+    return grams, miss
+
+
+def _fit_portions(A):
+    """Exact bounded fit for a single set, used to polish the search winner."""
+    res = lsq_linear(A, np.ones(A.shape[0]), bounds=PORTION_BOUNDS)
+    return res.x, float(np.abs(A @ res.x - 1.0).max())
+
+
+def optimize_meal(pool, target, warm_start=None, deadline=None):
+    """
+    Pick ITEMS_PER_MEAL foods from pool and their grams so the meal hits
+    calories, protein, carbs and fat together (target, same order as
+    NUTRIENT_COLUMNS).
+
+    Local search over single-food swaps: every candidate swap is scored in one
+    vectorized bounded least-squares solve, the best improving swap is kept,
+    and the search stops once all targets are within MACRO_TOLERANCE.
+    warm_start is the previous day's food rows for this meal; foods still in
+    the pool are kept and the rest are replaced by their closest match.
+
+    Returns (rows, grams, miss), where miss is the worst relative miss of
+    the final portions (it can exceed MACRO_TOLERANCE when no swap helps
+    any more), or None when the deadline passes first.
+    """
+    k = min(ITEMS_PER_MEAL, len(pool))
+    if k == 0:
+        return None
+
+    per_gram = pool[NUTRIENT_COLUMNS].to_numpy(dtype=float) / 100
+    target = np.maximum(np.asarray(target, dtype=float), 1e-6)
+    scaled = per_gram / target          # (n, 4)
+    n = len(pool)
+
+    # Initial selection: warm start, topped up by macro-profile similarity
+    names = pool["food_name"].tolist()
+    selected = []
+    if warm_start:
+        index_of = {name: i for i, name in enumerate(names)}
+        for row in warm_start[:k]:
+            i = index_of.get(row["food_name"])
+            if i is None or i in selected:
+                # Nearest remaining food by per-gram nutrient profile
+                prev = row[NUTRIENT_COLUMNS].to_numpy(dtype=float) / 100 / target
+                dist = np.abs(scaled - prev).sum(axis=1)
+                dist[selected] = np.inf
+                i = int(np.argmin(dist))
+            selected.append(i)
+    if len(selected) < k:
+        macro = per_gram[:, 1:]
+        norms = np.linalg.norm(macro, axis=1) * np.linalg.norm(target[1:])
+        scores = np.divide(macro @ target[1:], norms,
+                           out=np.zeros(n), where=norms > 0)
+        scores[selected] = -np.inf
+        for i in np.argsort(-scores):
+            if len(selected) == k:
+                break
+            selected.append(int(i))
+    selected = np.array(selected)
+
+    grams, miss = _fit_portions_batch(scaled[selected].T[None])
+    best_grams, best_miss = grams[0], miss[0]
+
+    while best_miss > MACRO_TOLERANCE:
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+
+        outside = np.setdiff1d(np.arange(n), selected)
+        if outside.size == 0:
+            break
+
+        # Every (position, replacement) pair as one batch
+        sets = np.repeat(selected[None], k * outside.size, axis=0)
+        sets[np.arange(sets.shape[0]), np.repeat(np.arange(k), outside.size)] = \
+            np.tile(outside, k)
+        grams, miss = _fit_portions_batch(np.transpose(scaled[sets], (0, 2, 1)))
+
+        i = int(np.argmin(miss))
+        if miss[i] >= best_miss - 1e-6:
+            break
+        selected, best_grams, best_miss = sets[i], grams[i], miss[i]
+
+    best_grams, best_miss = _fit_portions(scaled[selected].T)
+    rows = [pool.iloc[i] for i in selected]
+    return rows, best_grams, best_miss
+
+
+# ---------------------------------------------------------
+# 9. GENERATE WEEKLY MEAL PLAN
 # ---------------------------------------------------------
-def generate_meal_plan(user_profile, model, food_df, days=7, cooldown=2):
+def _meal_pool(filtered, meal):
+    if meal == "breakfast":
+        return filtered[filtered["food_name_lower"].isin([f.lower() for f in BREAKFAST_FOODS])]
+    elif meal == "lunch":
+        return filtered[filtered["food_name_lower"].isin([f.lower() for f in LUNCH_FOODS])]
+    return filtered[filtered["food_name_lower"].isin([f.lower() for f in DINNER_FOODS])]
+
+
+def generate_meal_plan(user_profile, model, food_df, days=7, cooldown=2,
+                       mode="greedy", time_budget_ms=OPTIMIZER_TIME_BUDGET_MS,
+                       allergen_index=None):
+    """
+    mode="greedy"   : top-3 foods by cosine similarity, grams fit to calories/protein.
+    mode="optimize" : optimize_meal per meal, warm-started from the previous day.
+                      Once time_budget_ms is spent the remaining meals use the
+                      greedy path, so latency stays bounded.
+                      Each day lists the solver per meal ("optimize", or
+                      "optimize_over_tolerance" when the search ended outside
+                      MACRO_TOLERANCE, or "greedy") and the achieved worst
+                      relative miss per meal in "macro_miss".
+    """
     weekly_plan = {}
     recent = {"breakfast": [], "lunch": [], "dinner": []}
+    previous = {}
     goal = user_profile["target_goal"].lower()
+    deadline = time.perf_counter() + time_budget_ms / 1000
+
+    # Predict daily calories (same profile every day)
+    X = pd.DataFrame([{
+        "age": user_profile["age"],
+        "weight_kg": user_profile["weight_kg"],
+        "height_cm": user_profile["height_cm"],
+        "gender": user_profile["gender"],
+        "activity_level": user_profile["activity_level"],
+        "target_goal": user_profile["target_goal"]
+    }])
+    daily_cals = float(model.predict(X)[0])
+
+    # Macro targets
+    cr, pr, fr = MACRO_SPLITS[goal]
+    total_pro = daily_cals * pr / 4
+    total_car = daily_cals * cr / 4
+    total_fat = daily_cals * fr / 9
+
+    # Filter foods once for the whole week
+    filtered = filter_foods(food_df, user_profile, allergen_index)
 
     for day in range(1, days + 1):
-        # Predict daily calories
-        X = pd.DataFrame([{
-            "age": user_profile["age"],
-            "weight_kg": user_profile["weight_kg"],
-            "height_cm": user_profile["height_cm"],
-            "gender": user_profile["gender"],
-            "activity_level": user_profile["activity_level"],
-            "target_goal": user_profile["target_goal"]
-        }])
-        daily_cals = float(model.predict(X)[0])
-
-        # Macro targets
-        cr, pr, fr = MACRO_SPLITS[goal]
-        total_pro = daily_cals * pr / 4
-        total_car = daily_cals * cr / 4
-        total_fat = daily_cals * fr / 9
-
-        # Filter foods
-        filtered = filter_foods(food_df, user_profile)
 
         meals = {}
+        solvers = []
+        misses = []
         splits = MEAL_SPLITS[goal]
 
         for meal, pct in splits.items():
@@ -199,20 +386,27 @@ def generate_meal_plan(user_profile, model, food_df, days=7, cooldown=2):
             target_vec = np.array([meal_pro, meal_car, meal_fat])
 
             # Meal-specific pool
-            if meal == "breakfast":
-                pool = filtered[filtered["food_name_lower"].isin([f.lower() for f in BREAKFAST_FOODS])]
-            elif meal == "lunch":
-                pool = filtered[filtered["food_name_lower"].isin([f.lower() for f in LUNCH_FOODS])]
-            else:
-                pool = filtered[filtered["food_name_lower"].isin([f.lower() for f in DINNER_FOODS])]
+            pool = _meal_pool(filtered, meal)
 
             # Avoid repeated foods
             pool = pool[~pool["food_name"].isin(recent[meal])]
             if pool.empty:
                 pool = filtered
 
-            topfoods = get_top_foods(pool, target_vec, top_n=3)
-            grams = solve_portions(topfoods, meal_cals, meal_pro)
+            solved = None
+            if mode == "optimize" and time.perf_counter() < deadline:
+                solved = optimize_meal(
+                    pool, [meal_cals, meal_pro, meal_car, meal_fat],
+                    warm_start=previous.get(meal), deadline=deadline
+                )
+
+            if solved is not None:
+                topfoods, grams, miss = solved
+                solvers.append("optimize" if miss <= MACRO_TOLERANCE else "optimize_over_tolerance")
+            else:
+                topfoods = get_top_foods(pool, target_vec, top_n=3)
+                grams = solve_portions(topfoods, meal_cals, meal_pro)
+                solvers.append("greedy")
 
             items = []
             for g, row in zip(grams, topfoods):
@@ -226,6 +420,10 @@ def generate_meal_plan(user_profile, model, food_df, days=7, cooldown=2):
                 })
                 recent[meal].append(row["food_name"])
             recent[meal] = recent[meal][-cooldown:]
+            achieved = [sum(item[c] for item in items) for c in NUTRIENT_COLUMNS]
+            misses.append(round(max(abs(a / t - 1) for a, t in
+                                    zip(achieved, [meal_cals, meal_pro, meal_car, meal_fat]) if t > 0), 3))
+            previous[meal] = topfoods
             meals[meal] = items
 
         weekly_plan[f"day_{day}"] = {
@@ -237,5 +435,8 @@ def generate_meal_plan(user_profile, model, food_df, days=7, cooldown=2):
             },
             "meals": meals
         }
+        if mode == "optimize":
+            weekly_plan[f"day_{day}"]["solver"] = solvers
+            weekly_plan[f"day_{day}"]["macro_miss"] = misses
 
     return weekly_plan
@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import joblib
+import numpy as np
+
+from profile_setup import calculate_bmr, calculate_tdee, goal_calories
+
+logger = logging.getLogger("calorie_models")
+
+FEATURE_SCHEMA = {
+    "categorical": ["gender", "activity_level", "target_goal"],
+    "numeric": ["age", "weight_kg", "height_cm"]
+}
+# App and stored labels (lowercase, "moderately active"...) -> the labels in
+# pakistan_user_profiles.csv that the models are trained on
+CATEGORY_LABELS = {
+    "gender": {"male": "Male", "female": "Female"},
+    "activity_level": {
+        "sedentary": "Sedentary",
+        "light": "Light", "lightly active": "Light",
+        "moderate": "Moderate", "moderately active": "Moderate",
+        "active": "Active", "very active": "Active", "extra active": "Active"
+    },
+    "target_goal": {"weight loss": "Weight Loss", "maintain": "Maintain", "weight gain": "Weight Gain"}
+}
+REGISTRY_ROOT = "models/calorie"
+LEGACY_MODEL_PATH = "models/calorie_model.pkl"
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# ---------------------------------------------------------
+# 1. VERSIONED MODEL DIRECTORIES
+# ---------------------------------------------------------
+class ModelRegistry:
+    """
+    models/calorie/<version>/model.pkl + metadata.json
+
+    metadata.json holds the feature schema, the training data hash and the
+    evaluation metrics. The ACTIVE file names the version served by default;
+    without it the newest version is served.
+    """
+
+    def __init__(self, root=REGISTRY_ROOT):
+        self.root = root
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            v for v in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, v, "model.pkl"))
+        )
+
+    def active_version(self):
+        marker = os.path.join(self.root, "ACTIVE")
+        if os.path.exists(marker):
+            with open(marker) as f:
+                version = f.read().strip()
+            if version in self.versions():
+                return version
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def set_active(self, version):
+        if version not in self.versions():
+            raise ValueError(f"Unknown calorie model version: {version}")
+        with open(os.path.join(self.root, "ACTIVE"), "w") as f:
+            f.write(version)
+
+    def register(self, model, training_data=None, metrics=None, params=None, version=None):
+        if version is None:
+            # Timestamped; a suffix keeps two runs in the same second apart
+            stamp = datetime.now().strftime("v%Y%m%d-%H%M%S")
+            version, n = stamp, 1
+            while True:
+                path = os.path.join(self.root, version)
+                try:
+                    os.makedirs(path, exist_ok=False)
+                    break
+                except FileExistsError:
+                    n += 1
+                    version = f"{stamp}-{n:02d}"
+        else:
+            path = os.path.join(self.root, version)
+            os.makedirs(path, exist_ok=False)
+
+        metadata = {
+            "version": version,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "feature_schema": FEATURE_SCHEMA,
+            "training_data": training_data,
+            "training_data_sha256": file_sha256(training_data) if training_data else None,
+            "metrics": metrics or {},
+            "params": params or {}
+        }
+        # Write the model first: a directory is only listed once model.pkl exists
+        joblib.dump(model, os.path.join(path, "model.pkl.tmp"))
+        with open(os.path.join(path, "metadata.json"), "w") as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(os.path.join(path, "model.pkl.tmp"), os.path.join(path, "model.pkl"))
+        return version
+
+    def metadata(self, version):
+        with open(os.path.join(self.root, version, "metadata.json")) as f:
+            return json.load(f)
+
+    def load(self, version):
+        """Load (once) and return the model for version."""
+        with self._lock:
+            if version not in self._loaded:
+                self._loaded[version] = joblib.load(os.path.join(self.root, version, "model.pkl"))
+            return self._loaded[version]
+
+
+# ---------------------------------------------------------
+# 2. FALLBACK PREDICTOR
+# ---------------------------------------------------------
+def normalize_features(X):
+    """Copy of X with categorical values mapped onto the training labels."""
+    X = X.copy()
+    for feature, labels in CATEGORY_LABELS.items():
+        if feature in X.columns:
+            X[feature] = [labels.get(str(v).lower().strip(), v) for v in X[feature]]
+    return X
+
+
+class TDEEFallbackModel:
+    """
+    Mifflin-St Jeor TDEE plus the goal offset, with the same predict(X)
+    interface as the trained pipeline. Used when no trained model exists.
+    """
+
+    version = "tdee-fallback"
+
+    def predict(self, X):
+        return np.array([
+            goal_calories(
+                calculate_tdee(
+                    calculate_bmr(r.weight_kg, r.height_cm, r.age, r.gender),
+                    r.activity_level
+                ),
+                r.target_goal
+            )
+            for r in X.itertuples(index=False)
+        ], dtype=float)
+
+
+# ---------------------------------------------------------
+# 3. SERVING: TRAFFIC SPLIT + SHADOW PREDICTIONS
+# ---------------------------------------------------------
+def _row_bucket(row):
+    """Stable bucket in [0, 1) per profile, so one user always hits one version."""
+    key = "|".join(str(row[c]) for c in FEATURE_SCHEMA["numeric"] + FEATURE_SCHEMA["categorical"])
+    return zlib.crc32(key.encode()) / 2**32
+
+
+class CalorieModelServer:
+    """
+    Serves a primary model, optionally routes a fraction of profiles to a
+    canary version, and runs shadow versions off the request path, logging
+    the delta between shadow and served predictions.
+
+    Exposes predict(X) so it drops in wherever a model is expected.
+    """
+
+    def __init__(self, primary, primary_version, canary=None, canary_fraction=0.0,
+                 shadows=None):
+        self.primary = primary
+        self.primary_version = primary_version
+        self.canary = canary                      # (version, model) or None
+        self.canary_fraction = canary_fraction
+        self.shadows = shadows or []              # [(version, model)]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow") \
+            if self.shadows else None
+        self._stats_lock = threading.Lock()
+        self._pending = 0
+        self.max_pending_shadows = 100   # shed shadow work rather than queue it
+        self.shadow_stats = {v: {"count": 0, "sum_abs_delta": 0.0, "max_abs_delta": 0.0}
+                             for v, _ in self.shadows}
+
+    def predict(self, X):
+        # The TDEE formula keeps the finer app labels ("extra active")
+        raw = X
+        X = normalize_features(X)
+        primary_input = raw if isinstance(self.primary, TDEEFallbackModel) else X
+        preds = np.asarray(self.primary.predict(primary_input), dtype=float)
+
+        if self.canary is not None and self.canary_fraction > 0:
+            buckets = np.array([_row_bucket(r) for _, r in X.iterrows()])
+            routed = buckets < self.canary_fraction
+            if routed.any():
+                preds[routed] = self.canary[1].predict(X[routed])
+
+        if self._executor is not None and self._pending < self.max_pending_shadows:
+            with self._stats_lock:
+                self._pending += 1
+            self._executor.submit(self._shadow, X.copy(), preds.copy())
+        return preds
+
+    def _shadow(self, X, served):
+        try:
+            self._run_shadows(X, served)
+        finally:
+            with self._stats_lock:
+                self._pending -= 1
+
+    def _run_shadows(self, X, served):
+        for version, model in self.shadows:
+            try:
+                delta = np.asarray(model.predict(X), dtype=float) - served
+            except Exception:
+                logger.exception("Shadow model %s failed", version)
+                continue
+            with self._stats_lock:
+                s = self.shadow_stats[version]
+                s["count"] += len(delta)
+                s["sum_abs_delta"] += float(np.abs(delta).sum())
+                s["max_abs_delta"] = max(s["max_abs_delta"], float(np.abs(delta).max()))
+            logger.info("shadow %s vs %s: mean delta %.1f kcal",
+                        version, self.primary_version, float(delta.mean()))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "primary": self.primary_version,
+                "canary": self.canary[0] if self.canary else None,
+                "canary_fraction": self.canary_fraction,
+                "shadows": {
+                    v: {
+                        "count": s["count"],
+                        "mean_abs_delta": round(s["sum_abs_delta"] / s["count"], 2) if s["count"] else None,
+                        "max_abs_delta": round(s["max_abs_delta"], 2)
+                    } for v, s in self.shadow_stats.items()
+                }
+            }
+
+
+def load_serving_model(registry=None, version=None, canary=None, canary_fraction=0.0,
+                       shadows=(), use_surface=False):
+    """
+    Build the server for the requested versions without ever training.
+    Falls back to the legacy models/calorie_model.pkl, then to TDEE.
+    use_surface serves the primary from its precomputed calorie surface
+    (calorie_surface.py) when one was built for that version.
+    """
+    registry = registry or ModelRegistry()
+    version = version or registry.active_version()
+
+    if version is not None:
+        primary = registry.load(version)
+        if use_surface:
+            from calorie_surface import CalorieSurface, surface_path
+            path = surface_path(registry, version)
+            if os.path.exists(path):
+                primary = CalorieSurface.load(path, fallback=primary)
+                logger.info("Serving %s from calorie surface (max error %s kcal)",
+                            version, primary.error.get("max_abs_error"))
+            else:
+                logger.warning("No calorie surface for %s, serving exact model", version)
+    elif os.path.exists(LEGACY_MODEL_PATH):
+        version, primary = "legacy", joblib.load(LEGACY_MODEL_PATH)
+    else:
+        logger.warning("No trained calorie model found, serving TDEE fallback")
+        fallback = TDEEFallbackModel()
+        version, primary = fallback.version, fallback
+
+    return CalorieModelServer(
+        primary, version,
+        canary=(canary, registry.load(canary)) if canary else None,
+        canary_fraction=canary_fraction,
+        shadows=[(v, registry.load(v)) for v in shadows if v]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned calorie models")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list")
+    train = sub.add_parser("train")
+    train.add_argument("--csv", default="pakistan_user_profiles.csv")
+    train.add_argument("--activate", action="store_true")
+    activate = sub.add_parser("activate")
+    activate.add_argument("version")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == "list":
+        active = registry.active_version()
+        for v in registry.versions():
+            meta = registry.metadata(v)
+            print(("* " if v == active else "  ") + v, json.dumps(meta["metrics"]))
+    elif args.command == "train":
+        import pandas as pd
+        from meal_plan import train_calorie_model, calorie_training_frame
+
+        pipeline = train_calorie_model(args.csv, model_path=None)
+        X, y = calorie_training_frame(pd.read_csv(args.csv))
+        train_mae = float(np.abs(pipeline.predict(X) - y).mean())
+        new_version = registry.register(
+            pipeline, training_data=args.csv, metrics={"train_mae": round(train_mae, 2)},
+            params=pipeline.named_steps["model"].get_params()
+        )
+        if args.activate:
+            registry.set_active(new_version)
+        print(new_version)
+    else:
+        registry.set_active(args.version)
@@ -0,0 +1,472 @@
+import argparse
+import atexit
+import json
+import os
+import signal
+import threading
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # no cross-process guard on Windows
+    fcntl = None
+
+ARCHIVE_DIR = "data/plan_archive"
+
+MEALS = ["breakfast", "lunch", "dinner"]
+TARGETS_ROW = len(MEALS)        # meal code of the per-day targets row
+SCALE = 10                      # fixed point: one decimal, as in the plan JSON
+VALUE_COLUMNS = ["food", "grams", "calories", "protein_g", "carbs_g", "fat_g"]
+KEY_COLUMNS = {"user": np.uint32, "day": np.int32, "meal": np.uint8, "slot": np.uint8}
+KEYFRAME_INTERVAL = 8           # at most this many deltas before a full plan
+SEAL_INTERVAL_S = 30            # buffered plans are sealed at least this often
+MAX_SHARDS = 64
+
+
+class ArchiveLocked(Exception):
+    """Another process already writes to this archive directory."""
+
+
+def _narrowest(values):
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if values.size == 0 or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+    return np.int64
+
+
+class _Vocabulary:
+    """
+    Append-only string dictionary persisted one JSON string per line, so
+    values with newlines (user ids come from requests) cannot shift ids.
+    """
+
+    def __init__(self, path, reserved=(), writable=True):
+        self.path = path
+        self.items = list(reserved)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.items = [self._parse(line) for line in f]
+        self.ids = {s: i for i, s in enumerate(self.items)}
+        if not writable:
+            return
+        self._file = open(path, "a")
+        if os.path.getsize(path) == 0:
+            for s in self.items:
+                self._file.write(json.dumps(s) + "\n")
+
+    @staticmethod
+    def _parse(line):
+        line = line.rstrip("\n")
+        # Archives written before entries were JSON-encoded hold raw lines
+        return json.loads(line) if line.startswith('"') else line
+
+    def id(self, value):
+        i = self.ids.get(value)
+        if i is None:
+            i = self.ids[value] = len(self.items)
+            self.items.append(value)
+            self._file.write(json.dumps(value) + "\n")
+            self._file.flush()
+        return i
+
+
+class PlanArchive:
+    """
+    Append-only columnar archive of generated meal plans.
+
+    One row per plan item plus one targets row per day. Food names and user
+    ids are dictionary-encoded, nutrients are fixed-point integers. A user's
+    plan with the same shape as their previous one is stored as the
+    difference to it (mostly zeros for a repeated weekly plan), with a full
+    keyframe every KEYFRAME_INTERVAL plans. Rows are buffered and sealed into
+    immutable segments of per-column .npy files, narrowed to the smallest
+    integer type and memory-mapped for reads. index.jsonl gives random
+    access by (user, date).
+
+    The buffer is sealed once it holds segment_rows rows or its oldest plan
+    is seal_interval seconds old, and on flush() (atexit, or the SIGTERM
+    handler from flush_on_sigterm). A writer holds an exclusive lock on
+    the directory, so a second process gets ArchiveLocked instead of
+    corrupting the vocabularies; read_only=True opens without the lock,
+    e.g. to export an archive a server is writing.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, segment_rows=50_000, seal_interval=SEAL_INTERVAL_S,
+                 read_only=False):
+        self.root = root
+        self.segment_rows = segment_rows
+        self.seal_interval = seal_interval
+        self.read_only = read_only
+        os.makedirs(os.path.join(root, "segments"), exist_ok=True)
+        if not read_only:
+            self._lock_file = self._acquire_lock()
+        self.foods = _Vocabulary(os.path.join(root, "foods.txt"), reserved=[""], writable=not read_only)
+        self.users = _Vocabulary(os.path.join(root, "users.txt"), writable=not read_only)
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._buffer = []
+        self._buffer_rows = 0
+        self._buffer_since = None
+
+        segments = os.path.join(root, "segments")
+        self._next_segment = len([s for s in os.listdir(segments) if not s.endswith(".tmp")])
+
+        # Plans that were still buffered when the process died are dropped
+        self.plans = {}        # user idx -> [plan entry], oldest first
+        self._index_path = os.path.join(root, "index.jsonl")
+        entries, stale = [], False
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    if entry["segment"] < self._next_segment:
+                        entries.append(entry)
+                    else:
+                        stale = True
+        if stale and not read_only:
+            with open(self._index_path + ".tmp", "w") as f:
+                f.writelines(json.dumps(e) + "\n" for e in entries)
+            os.replace(self._index_path + ".tmp", self._index_path)
+        for entry in entries:
+            self.plans.setdefault(entry["user"], []).append(entry)
+        if read_only:
+            return
+        self._index = open(self._index_path, "a")
+        atexit.register(self.flush)
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._sealer = None
+        if seal_interval:
+            self._sealer = threading.Thread(target=self._seal_periodically,
+                                            name="plan-archive-sealer", daemon=True)
+            self._sealer.start()
+
+    def _acquire_lock(self):
+        lock_file = open(os.path.join(self.root, "LOCK"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise ArchiveLocked(f"Plan archive {self.root} is open in another process")
+        return lock_file
+
+    def _seal_periodically(self):
+        while not self._stop.is_set():
+            urgent = self._wake.wait(min(self.seal_interval, 1.0))
+            self._wake.clear()
+            with self._lock:
+                if self._buffer_since is not None and (
+                        urgent or time.monotonic() - self._buffer_since >= self.seal_interval):
+                    self._seal()
+
+    def request_seal(self):
+        """Ask the sealer thread to seal now. Never blocks, so it is safe in a signal handler."""
+        self._wake.set()
+
+    # ---------------- Encoding ----------------
+    def _encode(self, user, start_day, plan):
+        rows = []
+        for d, day in enumerate(plan.values()):
+            targets = day["daily_macro_targets"]
+            rows.append((user, start_day + d, TARGETS_ROW, 0, 0, 0,
+                         day["predicted_daily_calories"], targets["protein_g"],
+                         targets["carbs_g"], targets["fat_g"]))
+            for m, meal in enumerate(MEALS):
+                for s, item in enumerate(day["meals"].get(meal, [])):
+                    rows.append((user, start_day + d, m, s, self.foods.id(item["food_name"]),
+                                 item["grams"], item["calories"], item["protein_g"],
+                                 item["carbs_g"], item["fat_g"]))
+        arr = np.array(rows, dtype=float)
+        keys = arr[:, :4].astype(np.int64)
+        values = arr[:, 4:].copy()
+        values[:, 1:] = np.round(values[:, 1:] * SCALE)
+        return keys, values.astype(np.int64)
+
+    def append(self, user_id, plan, start=None):
+        """Archive one generate_meal_plan result for user_id starting on start (a date)."""
+        if self.read_only:
+            raise RuntimeError("Plan archive opened read-only")
+        start_day = (start or date.today()).toordinal()
+        with self._lock:
+            user = self.users.id(str(user_id))
+            keys, values = self._encode(user, start_day, plan)
+
+            history = self.plans.get(user, [])
+            base = history[-1] if history else None
+            stored, base_ref = values, None
+            if base is not None and base["rows"] == len(values) and base["chain"] < KEYFRAME_INTERVAL:
+                prev_keys, prev_values = self._decode(base)
+                if np.array_equal(prev_keys[:, 2:], keys[:, 2:]):
+                    stored, base_ref = values - prev_values, len(history) - 1
+
+            entry = {
+                "user": user, "start": start_day, "days": len(plan), "rows": len(values),
+                "segment": self._next_segment, "offset": self._buffer_rows,
+                "base": base_ref, "chain": base["chain"] + 1 if base_ref is not None else 0
+            }
+            self._buffer.append((keys, stored))
+            self._buffer_rows += len(values)
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+            self.plans.setdefault(user, []).append(entry)
+            self._index.write(json.dumps(entry) + "\n")
+            self._index.flush()
+
+            if self._buffer_rows >= self.segment_rows:
+                self._seal()
+            return entry
+
+    def _seal(self):
+        if not self._buffer:
+            return
+        keys = np.concatenate([k for k, _ in self._buffer])
+        values = np.concatenate([v for _, v in self._buffer])
+        path = os.path.join(self.root, "segments", f"{self._next_segment:06d}")
+        tmp = path + ".tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for i, (col, dtype) in enumerate(KEY_COLUMNS.items()):
+            np.save(os.path.join(tmp, f"{col}.npy"), keys[:, i].astype(dtype))
+        for i, col in enumerate(VALUE_COLUMNS):
+            np.save(os.path.join(tmp, f"{col}.npy"), values[:, i].astype(_narrowest(values[:, i])))
+        os.rename(tmp, path)
+        self._next_segment += 1
+        self._buffer, self._buffer_rows, self._buffer_since = [], 0, None
+
+    def flush(self):
+        if self.read_only:
+            return
+        with self._lock:
+            self._seal()
+
+
+    # ---------------- Reading ----------------
+    def segment(self, number):
+        """Column name -> read-only memory-mapped array."""
+        seg = self._segments.get(number)
+        if seg is None:
+            path = os.path.join(self.root, "segments", f"{number:06d}")
+            seg = {col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode="r")
+                   for col in list(KEY_COLUMNS) + VALUE_COLUMNS}
+            self._segments[number] = seg
+        return seg
+
+    def _raw(self, entry):
+        if entry["segment"] == self._next_segment:
+            offset = 0
+            for k, v in self._buffer:
+                if offset == entry["offset"]:
+                    return k, v
+                offset += len(v)
+            raise KeyError("Plan not found in write buffer")
+        seg = self.segment(entry["segment"])
+        sl = slice(entry["offset"], entry["offset"] + entry["rows"])
+        keys = np.stack([seg[c][sl] for c in KEY_COLUMNS], axis=1).astype(np.int64)
+        values = np.stack([seg[c][sl] for c in VALUE_COLUMNS], axis=1).astype(np.int64)
+        return keys, values
+
+    def _decode(self, entry):
+        keys, values = self._raw(entry)
+        if entry["base"] is not None:
+            _, base_values = self._decode(self.plans[entry["user"]][entry["base"]])
+            values = values + base_values
+        return keys, values
+
+    def get(self, user_id, on=None):
+        """The plan archived for user_id covering date on (default: latest), as plan JSON."""
+        with self._lock:
+            user = self.users.ids.get(str(user_id))
+            history = self.plans.get(user, [])
+            if on is not None:
+                day = on.toordinal()
+                history = [e for e in history if e["start"] <= day < e["start"] + e["days"]]
+            if not history:
+                return None
+            keys, values = self._decode(history[-1])
+        return self._to_plan(keys, values)
+
+    def _to_plan(self, keys, values):
+        plan = {}
+        start = int(keys[:, 1].min())
+        for (user, day, meal, slot), v in zip(keys.tolist(), values.tolist()):
+            entry = plan.setdefault(f"day_{day - start + 1}", {"meals": {}})
+            grams, cal, pro, carb, fat = (x / SCALE for x in v[1:])
+            if meal == TARGETS_ROW:
+                entry["predicted_daily_calories"] = cal
+                entry["daily_macro_targets"] = {"protein_g": pro, "carbs_g": carb, "fat_g": fat}
+            else:
+                entry["meals"].setdefault(MEALS[meal], []).append({
+                    "food_name": self.foods.items[v[0]], "grams": grams, "calories": cal,
+                    "protein_g": pro, "carbs_g": carb, "fat_g": fat
+                })
+        return plan
+
+    def decoded_segments(self):
+        """
+        Yield (keys, values) per sealed segment with deltas resolved.
+        Bases always precede their deltas, so one pass keeps just the last
+        decoded plan per user.
+        """
+        last = {}
+        by_segment = {}
+        for history in self.plans.values():
+            for e in history:
+                by_segment.setdefault(e["segment"], []).append(e)
+        for number in range(self._next_segment):
+            seg = self.segment(number)
+            keys = np.stack([np.asarray(seg[c]) for c in KEY_COLUMNS], axis=1).astype(np.int64)
+            values = np.stack([np.asarray(seg[c]) for c in VALUE_COLUMNS], axis=1).astype(np.int64)
+            for e in sorted(by_segment.get(number, []), key=lambda e: e["offset"]):
+                sl = slice(e["offset"], e["offset"] + e["rows"])
+                if e["base"] is not None:
+                    values[sl] += last[e["user"]]
+                last[e["user"]] = values[sl].copy()
+            yield keys, values
+
+    def to_frame(self):
+        frames = []
+        for keys, values in self.decoded_segments():
+            df = pd.DataFrame(keys, columns=list(KEY_COLUMNS))
+            df["user_id"] = np.array(self.users.items, dtype=object)[keys[:, 0]]
+            df["date"] = [date.fromordinal(int(d)) for d in keys[:, 1]]
+            df["meal"] = np.array(MEALS + ["targets"], dtype=object)[keys[:, 2]]
+            df["food_name"] = np.array(self.foods.items, dtype=object)[values[:, 0]]
+            for i, col in enumerate(VALUE_COLUMNS[1:], start=1):
+                df[col] = values[:, i] / SCALE
+            frames.append(df.drop(columns=["user", "day"]))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def export_parquet(self, path):
+        """Bulk export of every sealed segment (needs pyarrow)."""
+        self.flush()
+        self.to_frame().to_parquet(path, index=False)
+
+
+def open_archive(root=ARCHIVE_DIR, **kwargs):
+    """
+    The archive at root, or the first free root/shard-N when another process
+    (e.g. another gunicorn worker) already writes to root.
+    """
+    candidates = [root] + [os.path.join(root, f"shard-{n}") for n in range(1, MAX_SHARDS)]
+    for path in candidates:
+        try:
+            return PlanArchive(path, **kwargs)
+        except ArchiveLocked:
+            continue
+    raise ArchiveLocked(f"All {MAX_SHARDS} shards of {root} are in use")
+
+
+def flush_on_sigterm(*archives):
+    """
+    Seal buffered plans on SIGTERM (sent by gunicorn, loadtest and the
+    dispatcher), which by default kills the process without running atexit.
+
+    The handler runs on the main thread, possibly in the middle of append()
+    holding the archive lock, so it never takes that lock: it wakes the
+    sealer threads and then hands over to the previous handler, or exits
+    with SystemExit so the atexit flush runs once the stack has unwound.
+    Only possible from the main thread; returns False otherwise.
+    """
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handler(signum, frame):
+            for archive in archives:
+                archive.request_seal()
+            if callable(previous):
+                previous(signum, frame)
+            elif previous != signal.SIG_IGN:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, handler)
+    except ValueError:
+        return False
+    return True
+
+
+# ---------------- Benchmark ----------------
+def benchmark(users=2000, weeks=4, root="/tmp/plan_archive_bench"):
+    """Size and full-scan time of the archive against JSON lines for synthetic plans."""
+    import shutil
+    from meal_plan import load_food_data, generate_meal_plan
+    from model_registry import TDEEFallbackModel
+
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    foods = load_food_data("foods.csv")
+    profiles = pd.read_csv("pakistan_user_profiles.csv").head(users)
+    model = TDEEFallbackModel()
+
+    plans = [generate_meal_plan({**p, "target_goal": p["target_goal"].lower(),
+                                 "health_conditions": []}, model, foods)
+             for p in profiles.to_dict("records")]
+
+    archive = PlanArchive(os.path.join(root, "archive"), seal_interval=None)
+    jsonl = os.path.join(root, "plans.jsonl")
+    start = date.today().toordinal()
+    t = time.perf_counter()
+    with open(jsonl, "w") as f:
+        for w in range(weeks):
+            for u, plan in enumerate(plans):
+                f.write(json.dumps({"user_id": f"user-{u}",
+                                    "start": date.fromordinal(start + 7 * w).isoformat(),
+                                    "plan": plan}) + "\n")
+    json_write = time.perf_counter() - t
+    t = time.perf_counter()
+    for w in range(weeks):
+        for u, plan in enumerate(plans):
+            archive.append(f"user-{u}", plan, date.fromordinal(start + 7 * w))
+    archive.flush()
+    archive_write = time.perf_counter() - t
+
+    t = time.perf_counter()
+    json_total = 0.0
+    with open(jsonl) as f:
+        for line in f:
+            for day in json.loads(line)["plan"].values():
+                json_total += sum(i["calories"] for m in day["meals"].values() for i in m)
+    json_scan = time.perf_counter() - t
+
+    t = time.perf_counter()
+    archive_total = 0.0
+    for keys, values in archive.decoded_segments():
+        archive_total += values[keys[:, 2] != TARGETS_ROW, 2].sum() / SCALE
+    archive_scan = time.perf_counter() - t
+
+    def size(path):
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+    return {
+        "plans": users * weeks,
+        "jsonl_bytes": size(jsonl),
+        "archive_bytes": size(archive.root),
+        "jsonl_write_s": round(json_write, 3),
+        "archive_write_s": round(archive_write, 3),
+        "jsonl_scan_s": round(json_scan, 3),
+        "archive_scan_s": round(archive_scan, 3),
+        "scan_totals_match": bool(abs(json_total - archive_total) < 1e-3 * max(1.0, json_total))
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan archive tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench")
+    bench.add_argument("--users", type=int, default=2000)
+    bench.add_argument("--weeks", type=int, default=4)
+    export = sub.add_parser("export")
+    export.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        print(json.dumps(benchmark(args.users, args.weeks), indent=2))
+    else:
+        PlanArchive(read_only=True).export_parquet(args.output)
@@ -0,0 +1,60 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+class PlanCache:
+    """
+    Small thread-safe LRU for generated plans.
+
+    Keys always include the catalog version the plan was built from, so a
+    catalog swap can never serve a plan made from old data; invalidate()
+    also drops those entries eagerly to free memory.
+    """
+
+    def __init__(self, max_entries=10_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(kind, version, payload):
+        return (kind, version, json.dumps(payload, sort_keys=True, default=str))
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, version=None):
+        """Drop every entry, or only the ones not built from version."""
+        with self._lock:
+            if version is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[1] != version]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
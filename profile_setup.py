@@ -4,8 +4,50 @@ from datetime import datetime
 
 from flask import jsonify, request
 
-
-def profile_setup():
+from firebase_sync import PROFILES_COLLECTION
+
+ACTIVITY_MULTIPLIERS = {
+    "sedentary": 1.2,
+    "lightly active": 1.375,
+    "moderately active": 1.55,
+    "very active": 1.725,
+    "extra active": 1.9,
+    # Labels used in pakistan_user_profiles.csv
+    "light": 1.375,
+    "moderate": 1.55,
+    "active": 1.725
+}
+
+# Daily calorie offset from TDEE per goal
+GOAL_CALORIE_ADJUSTMENTS = {
+    "weight loss": -500,
+    "maintain": 0,
+    "weight gain": 400
+}
+
+
+def calculate_bmr(weight_kg, height_cm, age, gender):
+    """Mifflin-St Jeor basal metabolic rate."""
+    bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age)
+    return bmr + 5 if str(gender).lower() == "male" else bmr - 161
+
+
+def calculate_tdee(bmr, activity):
+    # Default to sedentary if not found
+    return bmr * ACTIVITY_MULTIPLIERS.get(str(activity).lower().strip(), 1.2)
+
+
+def goal_calories(tdee, goal):
+    return tdee + GOAL_CALORIE_ADJUSTMENTS.get(str(goal).lower().strip(), 0)
+
+
+def profile_setup(store=None, sync=None):
+    """
+    Validate a profile and compute its health metrics. When the payload has a
+    user_id and a ProfileStore is given, the profile and metrics are saved so
+    planners can later be called with just {"user_id": ...}. With a
+    FirebaseSync the profile is also queued for Firestore.
+    """
     data = request.get_json()
     required_fields = ["age", "weight", "height", "gender", "activitylevel", "goal"]
     print("Data received:", data)
@@ -25,19 +67,8 @@ def profile_setup():
     height_m = height_ft * 0.3048
     height_cm = height_m * 100
     bmi = weight_kg / (height_m ** 2)
-    if gender == "male":
-        bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) + 5
-    else:
-        bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * age) - 161
-    activity_multipliers = {
-        "sedentary": 1.2,
-        "lightly active": 1.375,
-        "moderately active": 1.55,
-        "very active": 1.725,
-        "extra active": 1.9
-    }
-
-    tdee = bmr * activity_multipliers.get(activity.strip(), activity_multipliers)  # Default to sedentary if not found
+    bmr = calculate_bmr(weight_kg, height_cm, age, gender)
+    tdee = calculate_tdee(bmr, activity)
 
     if bmi <= 18.5:
         suggested_goal = "weight gain"
@@ -107,9 +138,35 @@ def profile_setup():
         "suggested_target_weight": round(suggested_target_weight, 2) if suggested_target_weight else None
     })
 
+    user_id = data.get("user_id")
+    if user_id:
+        profile = {
+            "user_id": str(user_id),
+            "age": age,
+            "gender": gender,
+            "weight_kg": weight_kg,
+            "height_cm": round(height_cm, 1),
+            "target_weight": target_weight,
+            "activity_level": activity,
+            "goal": goal,
+            "timeline_weeks": timeline_weeks,
+            "muscles": muscles,
+            "allergies": data.get("allergies", []),
+            "health_conditions": data.get("health_conditions", []),
+            "bmi": data["bmi"],
+            "bmr": data["bmr"],
+            "tdee": data["tdee"],
+            "suggested_goal": suggested_goal
+        }
+        if store is not None:
+            store.save(profile)
+        if sync is not None:
+            sync.enqueue(PROFILES_COLLECTION, user_id, profile)
+
     return jsonify({
         "status": "success",
         "message": "Profile saved & health metrics calculated",
+        "user_id": user_id,
         "bmi": data["bmi"],
         "bmr": data["bmr"],
         "tdee": data["tdee"],
@@ -0,0 +1,164 @@
+import json
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PROFILES_DB_PATH = "data/profiles.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id           TEXT PRIMARY KEY,
+    age               INTEGER NOT NULL,
+    gender            TEXT NOT NULL,
+    weight_kg         REAL NOT NULL,
+    height_cm         REAL NOT NULL,
+    target_weight     REAL,
+    activity_level    TEXT NOT NULL,
+    goal              TEXT NOT NULL,
+    timeline_weeks    INTEGER NOT NULL DEFAULT 0,
+    muscles           TEXT NOT NULL DEFAULT '[]',
+    allergies         TEXT NOT NULL DEFAULT '[]',
+    health_conditions TEXT NOT NULL DEFAULT '[]',
+    bmi               REAL NOT NULL,
+    bmr               REAL NOT NULL,
+    tdee              REAL NOT NULL,
+    suggested_goal    TEXT,
+    updated_at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_profiles_goal ON profiles (goal);
+CREATE INDEX IF NOT EXISTS idx_profiles_activity ON profiles (activity_level);
+CREATE INDEX IF NOT EXISTS idx_profiles_goal_activity ON profiles (goal, activity_level);
+"""
+
+# Fixed statement text so sqlite's per-connection statement cache reuses them
+UPSERT_SQL = """
+INSERT INTO profiles (user_id, age, gender, weight_kg, height_cm, target_weight, activity_level,
+                      goal, timeline_weeks, muscles, allergies, health_conditions,
+                      bmi, bmr, tdee, suggested_goal, updated_at)
+VALUES (:user_id, :age, :gender, :weight_kg, :height_cm, :target_weight, :activity_level,
+        :goal, :timeline_weeks, :muscles, :allergies, :health_conditions,
+        :bmi, :bmr, :tdee, :suggested_goal, :updated_at)
+ON CONFLICT (user_id) DO UPDATE SET
+    age = excluded.age, gender = excluded.gender, weight_kg = excluded.weight_kg,
+    height_cm = excluded.height_cm, target_weight = excluded.target_weight,
+    activity_level = excluded.activity_level, goal = excluded.goal,
+    timeline_weeks = excluded.timeline_weeks, muscles = excluded.muscles,
+    allergies = excluded.allergies, health_conditions = excluded.health_conditions,
+    bmi = excluded.bmi, bmr = excluded.bmr, tdee = excluded.tdee,
+    suggested_goal = excluded.suggested_goal, updated_at = excluded.updated_at
+"""
+SELECT_SQL = "SELECT * FROM profiles WHERE user_id = ?"
+COHORT_SQL = """
+SELECT * FROM profiles
+WHERE (:goal IS NULL OR goal = :goal)
+  AND (:activity_level IS NULL OR activity_level = :activity_level)
+ORDER BY user_id
+LIMIT :limit
+"""
+COUNT_SQL = """
+SELECT goal, activity_level, COUNT(*) AS users, AVG(bmi) AS avg_bmi, AVG(tdee) AS avg_tdee
+FROM profiles GROUP BY goal, activity_level
+"""
+
+JSON_FIELDS = ("muscles", "allergies", "health_conditions")
+
+
+class ProfileNotFound(KeyError):
+    pass
+
+
+class ProfileStore:
+    """
+    SQLite-backed user profiles with derived metrics (BMI/BMR/TDEE) stored
+    at write time. A fixed pool of connections is shared by request threads.
+    """
+
+    def __init__(self, path=PROFILES_DB_PATH, pool_size=4):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            conn = sqlite3.connect(path, check_same_thread=False, cached_statements=64)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._pool.put(conn)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _conn(self):
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @staticmethod
+    def _row(row):
+        profile = dict(row)
+        for field in JSON_FIELDS:
+            profile[field] = json.loads(profile[field])
+        return profile
+
+    def save(self, profile):
+        """Insert or replace one profile; profile must carry the derived metrics."""
+        record = {
+            "target_weight": None,
+            "timeline_weeks": 0,
+            "suggested_goal": None,
+            **profile,
+            "updated_at": time.time()
+        }
+        for field in JSON_FIELDS:
+            record[field] = json.dumps(list(profile.get(field) or []))
+        with self._conn() as conn, conn:
+            conn.execute(UPSERT_SQL, record)
+
+    def get(self, user_id):
+        with self._conn() as conn:
+            row = conn.execute(SELECT_SQL, (str(user_id),)).fetchone()
+        if row is None:
+            raise ProfileNotFound(f"No saved profile for user_id '{user_id}'")
+        return self._row(row)
+
+    def cohort(self, goal=None, activity_level=None, limit=1000):
+        with self._conn() as conn:
+            rows = conn.execute(COHORT_SQL, {"goal": goal, "activity_level": activity_level,
+                                             "limit": int(limit)}).fetchall()
+        return [self._row(r) for r in rows]
+
+    def cohort_summary(self):
+        with self._conn() as conn:
+            return [dict(r) for r in conn.execute(COUNT_SQL).fetchall()]
+
+
+# ---------------- Planner inputs ----------------
+def meal_profile(stored, overrides=None):
+    """Stored profile -> generate_meal_plan's user_profile."""
+    profile = {
+        "age": stored["age"],
+        "weight_kg": stored["weight_kg"],
+        "height_cm": stored["height_cm"],
+        "gender": stored["gender"],
+        "activity_level": stored["activity_level"],
+        "target_goal": stored["goal"],
+        "allergies": stored["allergies"],
+        "health_conditions": stored["health_conditions"]
+    }
+    profile.update({k: v for k, v in (overrides or {}).items() if k != "user_id"})
+    return profile
+
+
+def exercise_profile(stored, overrides=None):
+    """Stored profile -> the fields /exercise_plan reads."""
+    profile = {
+        "goal": stored["goal"],
+        "activitylevel": stored["activity_level"],
+        "timeline_weeks": stored["timeline_weeks"],
+        "muscles": stored["muscles"]
+    }
+    profile.update({k: v for k, v in (overrides or {}).items() if k != "user_id"})
+    return profile
@@ -0,0 +1,259 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+
+EVENTS_DB_PATH = "data/workout_events.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workout_events (
+    event_id      TEXT PRIMARY KEY,
+    user_id       TEXT NOT NULL,
+    exercise_name TEXT NOT NULL,
+    completed_at  REAL NOT NULL,
+    sets          REAL,
+    repetitions   REAL,
+    duration      REAL,
+    received_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_workout_events_user_time
+    ON workout_events (user_id, completed_at);
+"""
+
+INSERT_SQL = """
+INSERT OR IGNORE INTO workout_events
+    (event_id, user_id, exercise_name, completed_at, sets, repetitions, duration, received_at)
+VALUES (:event_id, :user_id, :exercise_name, :completed_at, :sets, :repetitions, :duration, :received_at)
+"""
+
+EXISTING_SQL = "SELECT event_id FROM workout_events WHERE event_id IN ({})"
+
+HISTORY_SQL = """
+SELECT event_id, user_id, exercise_name, completed_at, sets, repetitions, duration
+FROM workout_events
+WHERE user_id = ? AND completed_at >= ?
+ORDER BY completed_at DESC
+LIMIT ?
+"""
+
+
+class BufferFull(Exception):
+    """Raised when the write buffer is full; the client should retry later."""
+
+
+# ---------------- Validation ----------------
+def _timestamp(value):
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid completed_at: {value}")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def validate_event(data):
+    """Normalize one workout-completion payload or raise ValueError."""
+    if not isinstance(data, dict):
+        raise ValueError("Event must be a JSON object")
+
+    user_id = str(data.get("user_id") or "").strip()
+    exercise = str(data.get("exercise_name") or "").strip()
+    if not user_id:
+        raise ValueError("Missing required field: user_id")
+    if not exercise:
+        raise ValueError("Missing required field: exercise_name")
+
+    event = {
+        # Clients may send their own id so retries are idempotent
+        "event_id": str(data.get("event_id") or uuid.uuid4().hex),
+        "user_id": user_id,
+        "exercise_name": exercise,
+        "completed_at": _timestamp(data.get("completed_at")),
+        "received_at": time.time()
+    }
+    for field in ("sets", "repetitions", "duration"):
+        value = data.get(field)
+        if value is not None:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{field} must be a number")
+            if value < 0:
+                raise ValueError(f"{field} cannot be negative")
+        event[field] = value
+    return event
+
+
+# ---------------- Store ----------------
+class _Batch:
+    def __init__(self):
+        self.events = []
+        self.done = threading.Event()
+        self.error = None
+
+
+class WorkoutEventStore:
+    """
+    Append-only workout event log in SQLite (WAL mode).
+
+    append() only validates and buffers in memory; a background thread
+    commits everything buffered in one transaction every flush_interval
+    seconds (or as soon as batch_size events are waiting). Callers that need
+    a durable acknowledgement wait on the returned batch. When max_buffer
+    events are pending (including a batch being retried), append() raises
+    BufferFull instead of growing memory.
+
+    A commit that fails is retried up to max_attempts times with exponential
+    backoff; if it still fails the events are counted in stats["lost"] and
+    logged, and durable waiters get the error.
+
+    Listeners registered with on_commit receive only the events a commit
+    actually inserted, never duplicates of an already stored event_id.
+    """
+
+    def __init__(self, path=EVENTS_DB_PATH, max_buffer=20_000, batch_size=1_000,
+                 flush_interval=0.05, max_attempts=5, retry_backoff=0.1):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._writer = self._connect()
+        self._writer.executescript(SCHEMA)
+        self._readers = threading.local()
+
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._batch = _Batch()
+        self._closed = False
+        self.stats = {"accepted": 0, "rejected": 0, "flushed": 0, "batches": 0, "retries": 0,
+                      "duplicates": 0, "lost": 0, "last_flush_ms": 0.0}
+        self._listeners = []
+
+        self._thread = threading.Thread(target=self._run, name="workout-event-writer", daemon=True)
+        self._thread.start()
+        # Events acknowledged with 202 are still buffered: commit them on exit
+        atexit.register(self.close)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: a commit (one per batch) is on disk before it is acknowledged
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def on_commit(self, callback):
+        """callback(events) runs on the writer thread after each commit, with the newly stored events."""
+        self._listeners.append(callback)
+
+    def append(self, events):
+        """Buffer validated events; returns the batch they will be committed in."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Workout event store is closed")
+            if self._pending + len(events) > self.max_buffer:
+                self.stats["rejected"] += len(events)
+                raise BufferFull("Workout event buffer is full, retry shortly")
+            batch = self._batch
+            batch.events.extend(events)
+            self._pending += len(events)
+            self.stats["accepted"] += len(events)
+            if self._pending >= self.batch_size:
+                self._cond.notify()
+            return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and self._pending < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                batch, self._batch = self._batch, _Batch()
+                closed = self._closed
+            if batch.events:
+                self._flush(batch)
+                with self._cond:
+                    self._pending -= len(batch.events)
+            if closed:
+                return
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                with self._writer:
+                    new = self._new_events(batch.events)
+                    self._writer.executemany(INSERT_SQL, new)
+            except Exception as e:
+                batch.error = e
+                if attempt == self.max_attempts:
+                    self.stats["lost"] += len(batch.events)
+                    print(f"⚠ Dropping {len(batch.events)} workout events after "
+                          f"{attempt} failed commits")
+                    traceback.print_exc()
+                    break
+                self.stats["retries"] += 1
+                time.sleep(min(5.0, self.retry_backoff * 2 ** (attempt - 1)))
+            else:
+                batch.error = None
+                self.stats["flushed"] += len(new)
+                self.stats["duplicates"] += len(batch.events) - len(new)
+                self.stats["batches"] += 1
+                self._notify(new)
+                break
+        self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        batch.done.set()
+
+    def _new_events(self, events):
+        """Events whose event_id is neither stored yet nor repeated earlier in the batch."""
+        ids = [e["event_id"] for e in events]
+        seen = set()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self._writer.execute(EXISTING_SQL.format(",".join("?" * len(chunk))), chunk)
+            seen.update(r[0] for r in rows)
+        new = []
+        for event in events:
+            if event["event_id"] not in seen:
+                seen.add(event["event_id"])
+                new.append(event)
+        return new
+
+    def _notify(self, events):
+        if not events:
+            return
+        for callback in self._listeners:
+            try:
+                callback(events)
+            except Exception:
+                traceback.print_exc()
+
+    def history(self, user_id, since=0.0, limit=100):
+        """A user's most recent events, served from the (user_id, completed_at) index."""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            conn = self._readers.conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        rows = conn.execute(HISTORY_SQL, (str(user_id), float(since), int(limit))).fetchall()
+        return [dict(r) for r in rows]
+
+    def close(self):
+        """Commit everything buffered and stop the writer. Safe to call twice."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        self._writer.close()